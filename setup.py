@@ -9,6 +9,7 @@ setup(
     version="0.0.1",
     long_description=__doc__,
     packages=["txdps"],
+    package_data={"txdps": ["data/*.npy"]},
     include_package_data=True,
     zip_safe=False,
     install_requires=required,
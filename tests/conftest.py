@@ -0,0 +1,6 @@
+import os
+
+# read when the web app is imported (e.g. by txdps.cmds); an empty DSN
+# disables Sentry
+os.environ.setdefault("SENTRY_DSN", "")
+os.environ.setdefault("S3_LOCATION", "locations.csv")
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+from txdps import alerts
+from txdps.alerts import Dispatcher
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    sent = []
+    monkeypatch.delenv("SENDGRID_FROM_EMAIL", raising=False)
+    monkeypatch.setattr(alerts, "notify_phone", lambda msg, to: sent.append(to))
+    monkeypatch.setattr(
+        alerts, "notify_email", lambda msg, to, subject: sent.append(to)
+    )
+    monkeypatch.setattr(
+        alerts, "notify_emails", lambda msg, to, subject: sent.append(tuple(to))
+    )
+    return sent
+
+
+def _dispatch(*sends, **kwargs):
+    dispatcher = Dispatcher(backoff=0, batch_window=0.01, **kwargs)
+
+    async def main():
+        for send in sends:
+            await send(dispatcher)
+        await dispatcher.close()
+
+    asyncio.run(main())
+
+
+def test_on_sent_is_called_once_sent(sent):
+    called = []
+    _dispatch(
+        lambda d: d.send_sms("hi", 5125550100, on_sent=lambda: called.append("sms")),
+        lambda d: d.send_email(
+            "hi", "a@example.com", "s", on_sent=lambda: called.append("email")
+        ),
+    )
+    assert sent == [5125550100, "a@example.com"]
+    assert sorted(called) == ["email", "sms"]
+
+
+def test_on_sent_is_not_called_if_sending_fails(sent, monkeypatch):
+    def fail(msg, to):
+        raise ValueError("down")
+
+    monkeypatch.setattr(alerts, "notify_phone", fail)
+    called = []
+    _dispatch(
+        lambda d: d.send_sms("hi", 5125550100, on_sent=lambda: called.append(1)),
+        retries=1,
+    )
+    assert called == []
+
+
+def test_emails_are_batched_only_with_a_from_address(sent, monkeypatch):
+    def send_both(d):
+        async def send():
+            await d.send_email("hi", "a@example.com", "s")
+            await d.send_email("hi", "b@example.com", "s")
+
+        return send()
+
+    _dispatch(send_both)
+    assert sorted(sent) == ["a@example.com", "b@example.com"]
+
+    sent.clear()
+    monkeypatch.setenv("SENDGRID_FROM_EMAIL", "alerts@example.com")
+    _dispatch(send_both)
+    assert sent == [("a@example.com", "b@example.com")]
@@ -0,0 +1,72 @@
+import asyncio
+from datetime import date
+
+import pytest
+
+from txdps import cmds
+
+PERSON = {
+    "first_name": "Jane",
+    "last_name": "Doe",
+    "dob": date(1990, 1, 1),
+    "last_4_ssn": 1234,
+    "card_number": 5678,
+    "phone_number": None,
+    "email_address": None,
+}
+
+
+@pytest.fixture
+def held(monkeypatch):
+    """Fake the API so that only slot 3 can be held, recording slots tried."""
+    held = []
+
+    async def list_appointments(**kwargs):
+        return []
+
+    async def stream_matching_slots(**criteria):
+        for slot_id in [1, 2, 3, 4]:
+            yield {
+                "Id": slot_id * 10,
+                "Name": f"Location {slot_id}",
+                "ApptSlotId": slot_id,
+                "ApptStartDateTime": f"2026-01-0{slot_id}T08:00:00",
+                "ApptDuration": 20,
+            }
+
+    async def hold(slot_id, **kwargs):
+        held.append(slot_id)
+        if slot_id != 3:
+            return {"ErrorMessage": "This slot is no longer available."}
+        return {"Booking": {"ConfirmationNumber": 100000}}
+
+    monkeypatch.setattr(cmds, "_list_appointments", list_appointments)
+    monkeypatch.setattr(cmds, "stream_matching_slots", stream_matching_slots)
+    monkeypatch.setattr(cmds, "_hold", hold)
+    return held
+
+
+def _autohold(max_candidates):
+    return asyncio.run(
+        cmds._scan_and_autohold(
+            cities=None,
+            zip_code=78701,
+            max_dist=50,
+            min_date=date(2026, 1, 1),
+            max_date=date(2026, 2, 1),
+            fast_hold=True,
+            max_candidates=max_candidates,
+            **PERSON,
+        )
+    )
+
+
+def test_fast_hold_falls_back_to_the_next_candidate(held):
+    assert _autohold(max_candidates=3) == {"ConfirmationNumber": 100000}
+    assert held == [1, 2, 3]
+
+
+def test_fast_hold_gives_up_after_max_candidates(held):
+    with pytest.raises(ValueError, match="no longer available"):
+        _autohold(max_candidates=2)
+    assert held == [1, 2]
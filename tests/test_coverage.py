@@ -0,0 +1,45 @@
+import asyncio
+import random
+
+import pytest
+from aiohttp.test_utils import TestServer
+
+from txdps import api, scan
+from txdps.coverage import CoveragePlanner, greedy_set_cover
+from txdps.fetch import FetchScheduler
+from txdps.mockserver import MockScheduler, create_app
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_greedy_cover_covers_every_element(seed):
+    rng = random.Random(seed)
+    sets = {f"city {i}": rng.sample(range(50), 5) for i in range(40)}
+    cover = greedy_set_cover(sets)
+    assert set().union(*(sets[k] for k in cover)) == set().union(*sets.values())
+    assert len(cover) == len(set(cover))
+
+
+def test_planned_cities_find_every_location(monkeypatch):
+    monkeypatch.setattr(api, "BASE_API", api.BASE_API)
+    monkeypatch.setattr(api, "CASSETTE", None)
+    monkeypatch.setattr(api, "SCHEDULER", FetchScheduler(rate=1000))
+    monkeypatch.setattr(scan, "PLANNER", CoveragePlanner())
+    mock = MockScheduler(n_cities=60, n_locations=40)
+
+    async def main():
+        async with TestServer(create_app(mock)) as server:
+            api.BASE_API = str(server.make_url("/api"))
+            try:
+                # nothing's known yet, so every city is looked up
+                first = await scan.fetch_locations()
+                second = await scan.fetch_locations()
+            finally:
+                await api.POOL.close()
+        return first, second
+
+    first, second = asyncio.run(main())
+    planned = scan.PLANNER.plan(list(mock.cities))
+    assert len(planned) < len(mock.cities)
+    located = set().union(*(mock.cities[c] for c in mock.cities))
+    assert set(first.index) == located
+    assert set(second.index) == located
@@ -0,0 +1,83 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from txdps import distance
+from txdps.distmatrix import index_path, load_distance_matrix, write_distance_matrix
+
+
+def _write(path, location_ids, distances):
+    return write_distance_matrix(
+        path,
+        zips=np.array([78701, 77002]),
+        location_ids=np.array(location_ids),
+        latlongs=np.zeros((len(location_ids), 2)),
+        distances=np.array(distances),
+    )
+
+
+def test_rows_are_looked_up_by_zip_and_location(tmp_path):
+    matrix = _write(str(tmp_path / "d.npy"), [20, 10], [[2.0, 1.0], [4.0, 3.0]])
+    assert matrix.get(78701, [10, 20]).tolist() == [1.0, 2.0]
+    assert matrix.get("77002", [20]).tolist() == [4.0]
+    assert matrix.get(12345, [10]) is None
+    assert matrix.get(78701, [10, 30]) is None
+
+
+def test_matrix_is_reloaded_when_rewritten(tmp_path):
+    path = str(tmp_path / "d.npy")
+    _write(path, [10], [[1.0], [2.0]])
+    first = load_distance_matrix(path)
+    assert load_distance_matrix(path) is first
+
+    _write(path, [10, 20], [[1.0, 5.0], [2.0, 6.0]])
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1))
+    second = load_distance_matrix(path)
+    assert second is not first
+    assert second.get(78701, [20]).tolist() == [5.0]
+
+
+def test_mismatched_or_missing_matrices_are_not_used(tmp_path):
+    path = str(tmp_path / "d.npy")
+    assert load_distance_matrix(path) is None
+    _write(path, [10], [[1.0], [2.0]])
+    # as if the index was replaced but the matrix not yet
+    np.save(path, np.zeros((3, 3), dtype=np.float32))
+    assert load_distance_matrix(path) is None
+    assert os.path.exists(index_path(path))
+
+
+def test_matrix_from_another_build_is_not_used(tmp_path):
+    path = str(tmp_path / "d.npy")
+    _write(path, [10, 20], [[1.0, 2.0], [3.0, 4.0]])
+    with open(path, "rb") as f:
+        old_matrix = f.read()
+    # same shape, but for different locations
+    _write(path, [30, 40], [[5.0, 6.0], [7.0, 8.0]])
+    assert load_distance_matrix(path).get(78701, [30]).tolist() == [5.0]
+
+    # as if the index was replaced but the matrix not yet
+    with open(path, "wb") as f:
+        f.write(old_matrix)
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1))
+    assert load_distance_matrix(path) is None
+
+
+def test_update_distances_uses_matrix_and_falls_back(tmp_path, monkeypatch):
+    path = str(tmp_path / "d.npy")
+    df = pd.DataFrame(
+        {"Latitude": [30.27, 29.76], "Longitude": [-97.74, -95.37]},
+        index=pd.Index([10, 20], name="Id"),
+    )
+    computed = distance.update_distances(df.reset_index(), 78701)["Distance"]
+
+    assert distance.build_distance_matrix(path, df)
+    assert not distance.build_distance_matrix(path, df)
+    monkeypatch.setattr(distance, "DISTANCE_MATRIX_PATH", path)
+    looked_up = distance.update_distances(df.reset_index(), 78701)["Distance"]
+    assert looked_up.tolist() == computed.tolist()
+
+    # a location the matrix doesn't cover
+    df.loc[30] = (32.78, -96.8)
+    assert distance.update_distances(df.reset_index(), 78701)["Distance"].notna().all()
@@ -0,0 +1,90 @@
+import asyncio
+
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from txdps import api
+from txdps.fetch import FetchScheduler, RetryableError
+from txdps.mockserver import MockScheduler, create_app
+
+
+@pytest.fixture(autouse=True)
+def base_api(monkeypatch):
+    # restored after each test, which points it at its own server
+    monkeypatch.setattr(api, "BASE_API", api.BASE_API)
+    monkeypatch.setattr(api, "CASSETTE", None)
+
+
+def _fetch_cities(app, cities, retries=2):
+    """Fetch the cities from the app through a scheduler that doesn't wait."""
+    scheduler = FetchScheduler(rate=1000, retries=retries, backoff=0)
+
+    async def main():
+        async with TestServer(app) as server:
+            api.BASE_API = str(server.make_url("/api"))
+            async with aiohttp.ClientSession() as session:
+                return await asyncio.gather(
+                    *[
+                        scheduler.fetch(city, api.get_city_info, session, city=city)
+                        for city in cities
+                    ]
+                )
+
+    return asyncio.run(main())
+
+
+def _flaky_app(responses):
+    """Serve AvailableLocation with each of `responses` in turn, then a record."""
+    responses = list(responses)
+    calls = []
+
+    async def available_location(request):
+        calls.append(request.path)
+        if responses:
+            return responses.pop(0)
+        return web.json_response([{"Id": 1, "Name": "Austin North"}])
+
+    app = web.Application()
+    app.add_routes([web.post("/api/AvailableLocation", available_location)])
+    return app, calls
+
+
+@pytest.mark.parametrize("status", [429, 500, 502, 503])
+def test_retries_throttling_and_server_errors(status):
+    error = web.json_response({"Message": "Try again"}, status=status)
+    app, calls = _flaky_app([error])
+    [result] = _fetch_cities(app, ["Austin"])
+    assert result.ok
+    assert result.value == [{"Id": 1, "Name": "Austin North"}]
+    assert len(calls) == 2
+
+
+def test_retries_error_pages_that_arent_json():
+    page = web.Response(
+        text="<html><body>Service Unavailable</body></html>",
+        status=503,
+        content_type="text/html",
+    )
+    app, calls = _flaky_app([page])
+    [result] = _fetch_cities(app, ["Austin"])
+    assert result.ok
+    assert len(calls) == 2
+
+
+def test_gives_up_after_the_retry_limit():
+    app = create_app(MockScheduler(n_cities=3, n_locations=10), error_rate=1.0)
+    results = _fetch_cities(app, ["City 0", "City 1"], retries=2)
+    assert [r.key for r in results] == ["City 0", "City 1"]
+    assert not any(r.ok for r in results)
+    assert all(isinstance(r.error, RetryableError) for r in results)
+    assert "An error has occurred." in str(results[0].error)
+
+
+def test_client_errors_are_not_retried():
+    app, calls = _flaky_app([web.json_response({"Message": "Bad city"}, status=400)])
+    [result] = _fetch_cities(app, ["Nowhere"])
+    assert not result.ok
+    assert not isinstance(result.error, RetryableError)
+    assert len(calls) == 1
@@ -0,0 +1,79 @@
+from datetime import datetime
+
+import pandas as pd
+
+from txdps.history import HistoryStore
+
+
+def _snapshot(*dates):
+    return pd.DataFrame(
+        {
+            "Name": [f"Location {i}" for i in range(len(dates))],
+            "NextAvailableDate": pd.to_datetime(list(dates)),
+        },
+        index=pd.Index(range(len(dates)), name="Id"),
+    )
+
+
+def test_append_only_writes_changes(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    written = [
+        store.append(_snapshot(*dates), observed_at=datetime(2026, 1, 1, hour))
+        for hour, dates in enumerate(
+            [
+                ["2026-02-01", "2026-02-05"],
+                ["2026-02-01", "2026-02-05"],
+                ["2026-01-20", "2026-02-05"],
+            ]
+        )
+    ]
+    assert written == [2, 0, 1]
+
+
+def test_append_handles_missing_dates(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    written = [
+        store.append(_snapshot(date), observed_at=datetime(2026, 1, 1, hour))
+        for hour, date in enumerate(["2026-01-01", None, None, "2026-01-01"])
+    ]
+    assert written == [1, 1, 0, 1]
+
+    series = store.series()
+    assert series["NextAvailableDate"].isna().tolist() == [False, True, False]
+
+
+def test_first_append_of_the_day_writes_everything(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    store.append(_snapshot("2026-02-01"), observed_at=datetime(2026, 1, 1, 12))
+    assert (
+        store.append(_snapshot("2026-02-01"), observed_at=datetime(2026, 1, 2, 12))
+        == 1
+    )
+    assert store.days() == [datetime(2026, 1, 1).date(), datetime(2026, 1, 2).date()]
+
+
+def test_series_starts_with_value_as_of_start(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    for hour, date in [(1, "2026-02-01"), (2, "2026-01-20"), (5, "2026-01-25")]:
+        store.append(_snapshot(date), observed_at=datetime(2026, 1, 1, hour))
+
+    series = store.series(start=datetime(2026, 1, 1, 3))
+    assert series["ObservedAt"].tolist() == [
+        pd.Timestamp(2026, 1, 1, 3),
+        pd.Timestamp(2026, 1, 1, 5),
+    ]
+    assert series["NextAvailableDate"].tolist() == [
+        pd.Timestamp("2026-01-20"),
+        pd.Timestamp("2026-01-25"),
+    ]
+
+
+def test_summarize_counts_moves(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    for hour, date in [(0, "2026-02-01"), (6, "2026-01-20"), (12, "2026-01-25")]:
+        store.append(_snapshot(date), observed_at=datetime(2026, 1, 1, hour))
+
+    summary = store.summarize()
+    assert summary.loc[0, "Earlier"] == 1
+    assert summary.loc[0, "Later"] == 1
+    assert summary.loc[0, "EarlierPerDay"] == 2
@@ -0,0 +1,129 @@
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+from txdps import search
+from txdps.search import LocalIndex, QueryCache
+
+
+def test_local_index_matches_prefixes_and_typos():
+    index = LocalIndex(
+        pd.DataFrame(
+            {
+                "SiteId": [1, 2, 3],
+                "SiteName": ["Austin North", "Houston Mega Center", "Dallas East"],
+                "CityName": ["Austin", "Houston", "Dallas"],
+                "ZipCode": ["78753", "77040", "75228"],
+            }
+        )
+    )
+    assert index.search("houston") == [2]
+    assert index.search("hou") == [2]
+    assert index.search("huoston") == [2]
+    assert index.search("mega dallas") == []
+    assert index.search("7") == [1, 2, 3]
+    assert index.search("77") == [2]
+
+
+def test_filter_df_caches_results(monkeypatch):
+    monkeypatch.setattr(search, "SEARCH_BACKEND", "local")
+    monkeypatch.setattr(search, "QUERY_CACHE", QueryCache())
+    calls = []
+    real_search = search._search
+
+    def counted_search(df, query, version=None):
+        calls.append(query)
+        return real_search(df, query, version=version)
+
+    monkeypatch.setattr(search, "_search", counted_search)
+    df = pd.DataFrame({"SiteId": [1, 2], "SiteName": ["Austin", "Houston"]})
+
+    for query in ["Austin", " austin", "AUSTIN "]:
+        assert search.filter_df(df, query, version="v1").SiteId.tolist() == [1]
+    assert len(calls) == 1
+    search.filter_df(df, "austin", version="v2")
+    assert len(calls) == 2
+
+
+def test_cache_expires_and_evicts():
+    cache = QueryCache(max_size=2, ttl=0.05)
+    cache.get("a", lambda: 1)
+    cache.get("b", lambda: 2)
+    cache.get("a", lambda: 0)
+    cache.get("c", lambda: 3)
+    # b was least recently used
+    assert cache.get("b", lambda: 4) == 4
+    assert cache.get("a", lambda: 0) == 0
+    time.sleep(0.06)
+    assert cache.get("c", lambda: 5) == 5
+
+
+def test_concurrent_lookups_compute_once():
+    cache = QueryCache()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.05)
+        return frozenset([1])
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(cache.get("q", compute)))
+        for _ in range(10)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert results == [frozenset([1])] * 10
+
+
+class Interrupted(BaseException):
+    """Like KeyboardInterrupt, which isn't an Exception either."""
+
+
+@pytest.mark.parametrize("error", [ValueError, Interrupted])
+def test_failures_are_not_cached(error):
+    cache = QueryCache()
+
+    def fail():
+        time.sleep(0.05)
+        raise error()
+
+    waiter_errors = []
+
+    def wait():
+        try:
+            cache.get("q", lambda: "unused")
+        except (ValueError, Interrupted) as exc:
+            waiter_errors.append(exc)
+
+    leader = threading.Thread(target=lambda: pytest.raises(error, cache.get, "q", fail))
+    leader.start()
+    time.sleep(0.01)
+    waiter = threading.Thread(target=wait)
+    waiter.start()
+    leader.join()
+    waiter.join()
+
+    assert [type(e) for e in waiter_errors] == [error]
+    assert cache.get("q", lambda: "computed") == "computed"
+
+
+def test_clear_drops_results_computed_before_it():
+    cache = QueryCache()
+
+    def compute():
+        time.sleep(0.05)
+        return "stale"
+
+    thread = threading.Thread(target=lambda: cache.get("q", compute))
+    thread.start()
+    time.sleep(0.01)
+    cache.clear()
+    thread.join()
+    assert cache.get("q", lambda: "fresh") == "fresh"
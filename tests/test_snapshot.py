@@ -0,0 +1,76 @@
+import pandas as pd
+import pytest
+
+from txdps import snapshot
+from txdps.snapshot import (
+    publish_snapshot,
+    read_changes,
+    read_manifest,
+    read_snapshot,
+    snapshot_hash,
+)
+
+
+def _locations(dates):
+    return pd.DataFrame(
+        {
+            "Name": [f"Location {i}" for i in dates],
+            "NextAvailableDate": pd.to_datetime(list(dates.values())),
+            "Latitude": 30.0,
+            "Longitude": -97.0,
+        },
+        index=pd.Index(list(dates), name="Id"),
+    )
+
+
+@pytest.fixture(autouse=True)
+def forget_published(monkeypatch):
+    monkeypatch.setattr(snapshot, "_PUBLISHED", {})
+
+
+@pytest.mark.parametrize("name", ["locations", "locations.csv", "locations.parquet"])
+def test_round_trip(tmp_path, name):
+    uri = str(tmp_path / name)
+    df = _locations({1: "2026-01-02", 2: "2026-01-03"})
+    assert publish_snapshot(df, uri)
+
+    read = read_snapshot(uri)
+    assert read["Id"].tolist() == [1, 2]
+    assert read["NextAvailableDate"].tolist() == df["NextAvailableDate"].tolist()
+
+
+def test_unchanged_snapshots_are_not_rewritten(tmp_path):
+    uri = str(tmp_path / "locations.parquet")
+    df = _locations({1: "2026-01-02"})
+    assert publish_snapshot(df, uri)
+    manifest = read_manifest(uri)
+    assert manifest["hash"] == snapshot_hash(df)
+    assert manifest["previous_hash"] is None
+    assert manifest["rows"] == 1
+
+    assert not publish_snapshot(df.copy(), uri)
+    assert read_manifest(uri) == manifest
+
+    changed = _locations({1: "2026-01-01"})
+    assert publish_snapshot(changed, uri)
+    assert read_manifest(uri)["previous_hash"] == manifest["hash"]
+
+
+@pytest.mark.parametrize("same_process", [True, False])
+def test_change_feed(tmp_path, monkeypatch, same_process):
+    uri = str(tmp_path / "locations.parquet")
+    publish_snapshot(_locations({1: "2026-01-05", 2: "2026-01-05"}), uri)
+    assert read_changes(uri) is None
+    if not same_process:
+        # the previous snapshot has to be read back to diff against
+        monkeypatch.setattr(snapshot, "_PUBLISHED", {})
+
+    publish_snapshot(_locations({1: "2026-01-03", 3: "2026-01-04"}), uri)
+    feed = read_changes(uri)
+    assert feed["hash"] == read_manifest(uri)["hash"]
+    assert feed["previous_hash"] == read_manifest(uri)["previous_hash"]
+    assert [(c["Id"], c["Change"]) for c in feed["changes"]] == [
+        (1, "earlier"),
+        (3, "appeared"),
+        (2, "disappeared"),
+    ]
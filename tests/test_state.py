@@ -0,0 +1,68 @@
+import sqlite3
+
+import pandas as pd
+
+from txdps.state import SeenSlots
+
+
+def _slots(*slots):
+    """Make slots from (location id, slot id, start) tuples."""
+    location_ids, slot_ids, starts = zip(*slots)
+    return pd.DataFrame(
+        {"ApptSlotId": slot_ids, "ApptStartDateTime": starts},
+        index=pd.Index(location_ids, name="Id"),
+    )
+
+
+def test_only_new_slots_are_unseen(tmp_path):
+    seen = SeenSlots(str(tmp_path / "state.db"))
+    seen.mark("sub", _slots((1, 10, "2026-01-05T08:00:00")))
+
+    df = _slots(
+        (1, 10, "2026-01-05T08:00:00"),
+        (1, 11, "2026-01-06T08:00:00"),
+        (2, 10, "2026-01-05T08:00:00"),
+    )
+    assert seen.unseen("sub", df)["ApptSlotId"].tolist() == [11, 10]
+    assert len(seen.unseen("other", df)) == 3
+
+
+def test_missing_slot_info_is_stored_as_null(tmp_path):
+    path = str(tmp_path / "state.db")
+    seen = SeenSlots(path)
+    df = _slots((1, None, None))
+    seen.mark("sub", df)
+    seen.mark("sub", df)
+
+    with sqlite3.connect(path) as conn:
+        rows = conn.execute("SELECT slot_id, slot_start FROM seen_slots").fetchall()
+    assert rows == [(None, None)]
+    assert not len(seen.unseen("sub", df))
+    assert len(seen.unseen("sub", _slots((1, 10, "2026-01-05T08:00:00")))) == 1
+
+
+def test_notifications_expire(tmp_path):
+    seen = SeenSlots(str(tmp_path / "state.db"), ttl_hours=1)
+    df = _slots((1, 10, "2026-01-05T08:00:00"))
+    seen.mark("sub", df, now=1000)
+
+    assert seen.expire(now=1000 + 1800) == 0
+    assert seen.expire(now=1000 + 7200) == 1
+    assert len(seen.unseen("sub", df)) == 1
+
+
+def test_old_tables_are_replaced(tmp_path):
+    path = str(tmp_path / "state.db")
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            "CREATE TABLE seen_slots (subscriber TEXT, location_id INTEGER, "
+            "slot_id INTEGER, slot_start TEXT, notified_at REAL, "
+            "PRIMARY KEY (subscriber, location_id))"
+        )
+
+    seen = SeenSlots(path)
+    seen.mark(
+        "sub",
+        _slots((1, 10, "2026-01-05T08:00:00"), (1, 11, "2026-01-06T08:00:00")),
+    )
+    assert len(seen.unseen("sub", _slots((1, 11, "2026-01-06T08:00:00")))) == 0
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from txdps.distance import ZIP_TABLE
+from txdps.zipcodes import ZipTable, build_zip_table, load_zip_table
+
+
+@pytest.fixture
+def table(tmp_path):
+    source = tmp_path / "gazetteer.txt"
+    source.write_text(
+        "GEOID\tALAND\tINTPTLAT\tINTPTLONG\n"
+        "78701\t1\t30.2672\t-97.7423\n"
+        "00501\t1\t40.8179\t-73.0453\n"
+        "77002\t1\t29.7502\t-95.3677\n"
+    )
+    return build_zip_table(str(tmp_path / "zips.npy"), source=str(source))
+
+
+def test_get(table):
+    assert len(table) == 3
+    assert table.get(78701) == (30.2672, -97.7423)
+    assert table.get("00501") == (40.8179, -73.0453)
+    for zip_code in [78702, 0, 100000, -1, None, "abc"]:
+        assert table.get(zip_code) is None
+
+
+def test_latlongs(table):
+    latlongs = table.latlongs([77002, 12345, 99999])
+    assert latlongs[0].round(4).tolist() == [29.7502, -95.3677]
+    assert np.isnan(latlongs[1:]).all()
+
+
+def test_bad_tables_are_not_loaded(tmp_path):
+    assert load_zip_table(str(tmp_path / "missing.npy")) is None
+    path = tmp_path / "bad.npy"
+    path.write_bytes(b"not a table")
+    assert load_zip_table(str(path)) is None
+    with pytest.raises(ValueError):
+        ZipTable(str(path))
+
+
+def test_table_ships_in_package():
+    assert ZIP_TABLE is not None
+    assert ZIP_TABLE.get(78701) == (30.2672, -97.7423)
@@ -1,29 +1,40 @@
 """Notification helpers."""
+import asyncio
+import functools
 import logging
 import os
+import random
+import typing as T
 
 import sendgrid
 import twilio.rest
 
 
+@functools.lru_cache(maxsize=None)
+def _twilio_client() -> twilio.rest.Client:
+    return twilio.rest.Client(
+        os.getenv("TWILIO_ACCOUNT_SID"), os.getenv("TWILIO_AUTH_TOKEN")
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _sendgrid_client() -> sendgrid.SendGridAPIClient:
+    return sendgrid.SendGridAPIClient(api_key=os.environ.get("SENDGRID_API_KEY"))
+
+
 def notify_phone(msg: str, phone_number: int):
     """Send a text containing the given message to the given phone number."""
-    account_sid = os.getenv("TWILIO_ACCOUNT_SID")
-    auth_token = os.getenv("TWILIO_AUTH_TOKEN")
     origin_phone = os.getenv("TWILIO_PHONE_NUMBER")
-    client = twilio.rest.Client(account_sid, auth_token)
     final_phone = f"+1{phone_number}"
-    message = client.messages.create(body=msg, from_=origin_phone, to=final_phone)
+    message = _twilio_client().messages.create(
+        body=msg, from_=origin_phone, to=final_phone
+    )
     logging.info(f"Sent SMS to {final_phone}")
     return message
 
 
-def notify_email(msg: str, email_address: str, subject: str):
-    """Send an email containing the given message to the given email address."""
-    client = sendgrid.SendGridAPIClient(api_key=os.environ.get("SENDGRID_API_KEY"))
-    from_email = sendgrid.helpers.mail.Email(email_address)
-    to_email = sendgrid.helpers.mail.To(email_address)
-    html_msg = f"""
+def _html(msg: str) -> str:
+    return f"""
 <html>
 <body>
 <pre style="font: monospace">
@@ -32,10 +43,193 @@ def notify_email(msg: str, email_address: str, subject: str):
 </body>
 </html>
 """
-    content = sendgrid.helpers.mail.Content("text/html", html_msg)
-    mail = sendgrid.helpers.mail.Mail(from_email, to_email, subject, content)
-    response = client.client.mail.send.post(request_body=mail.get())
+
+
+def _send_mail(mail: sendgrid.helpers.mail.Mail, recipients: str):
+    response = _sendgrid_client().client.mail.send.post(request_body=mail.get())
     if response.status_code < 200 or response.status_code >= 300:
         raise ValueError(f"Failed to send email: {response.body}")
-    logging.info(f"Sent email to {email_address}")
+    logging.info(f"Sent email to {recipients}")
     return response
+
+
+def notify_email(msg: str, email_address: str, subject: str):
+    """Send an email containing the given message to the given email address."""
+    from_email = sendgrid.helpers.mail.Email(email_address)
+    to_email = sendgrid.helpers.mail.To(email_address)
+    content = sendgrid.helpers.mail.Content("text/html", _html(msg))
+    mail = sendgrid.helpers.mail.Mail(from_email, to_email, subject, content)
+    return _send_mail(mail, email_address)
+
+
+def notify_emails(msg: str, email_addresses: T.List[str], subject: str):
+    """Send the same email to many addresses in one request.
+
+    Each address gets its own personalization, so recipients don't see each
+    other. Sent from SENDGRID_FROM_EMAIL, which has to be set, since sending
+    from any one recipient's address would show it to the rest.
+    """
+    from_email = os.getenv("SENDGRID_FROM_EMAIL")
+    if not from_email:
+        raise ValueError("SENDGRID_FROM_EMAIL must be set to batch emails")
+    mail = sendgrid.helpers.mail.Mail(
+        from_email=from_email,
+        to_emails=[sendgrid.helpers.mail.To(a) for a in email_addresses],
+        subject=subject,
+        html_content=_html(msg),
+        is_multiple=True,
+    )
+    return _send_mail(mail, ", ".join(email_addresses))
+
+
+class Dispatcher:
+    """Send notifications in the background, off of the scan and hold path.
+
+    Notifications are put on a bounded queue and sent by a few workers, each
+    send running in a thread since the Twilio and SendGrid clients block.
+    Failed sends are retried with exponential backoff. If SENDGRID_FROM_EMAIL
+    is set, identical emails queued within `batch_window` seconds of each other
+    are sent as one request; otherwise each is sent on its own, from the
+    recipient's address. Senders can pass an `on_sent` callback to be called
+    once their notification has actually been sent.
+    """
+
+    # SendGrid's limit on personalizations per request
+    MAX_BATCH = 1000
+
+    def __init__(
+        self,
+        workers: int = 4,
+        max_queued: int = 100,
+        retries: int = 3,
+        backoff: float = 1.0,
+        batch_window: float = 0.5,
+    ):
+        """Configure the dispatcher; it starts once something is sent.
+
+        :param workers: notifications to send at once
+        :param max_queued: notifications to queue before senders have to wait
+        :param retries: times to retry a failed send
+        :param backoff: seconds to wait before the first retry, doubling after
+        :param batch_window: seconds to wait for identical emails to batch
+        """
+        self.workers = workers
+        self.max_queued = max_queued
+        self.retries = retries
+        self.backoff = backoff
+        self.batch_window = batch_window
+        self._loop = None
+
+    def _start(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=self.max_queued)
+        self._batches: T.Dict[
+            T.Tuple[str, str], T.List[T.Tuple[str, T.Optional[T.Callable]]]
+        ] = {}
+        self._flushes: T.Dict[T.Tuple[str, str], asyncio.Task] = {}
+        self._workers = [
+            asyncio.ensure_future(self._work()) for _ in range(self.workers)
+        ]
+
+    async def _work(self):
+        while True:
+            fn, args, callbacks = await self._queue.get()
+            try:
+                if await self._send(fn, *args):
+                    for on_sent in callbacks:
+                        if on_sent is not None:
+                            on_sent()
+            except Exception as exc:
+                logging.exception(f"Failed to handle sent notification: {exc}")
+            finally:
+                self._queue.task_done()
+
+    async def _send(self, fn: T.Callable, *args) -> bool:
+        """Send, retrying on failure, returning whether it was sent."""
+        for attempt in range(self.retries + 1):
+            try:
+                await self._loop.run_in_executor(None, fn, *args)
+                return True
+            except Exception as exc:
+                if attempt == self.retries:
+                    logging.exception(f"Giving up on notification: {exc}")
+                    return False
+                delay = random.uniform(0, self.backoff * 2 ** attempt)
+                logging.warning(
+                    f"Failed to send notification ({exc}); retrying in {delay:.1f}s"
+                )
+                await asyncio.sleep(delay)
+
+    async def send_sms(
+        self, msg: str, phone_number: int, on_sent: T.Callable[[], None] = None
+    ):
+        """Queue a text, waiting only if the queue is full."""
+        self._start()
+        await self._queue.put((notify_phone, (msg, phone_number), [on_sent]))
+
+    async def send_email(
+        self,
+        msg: str,
+        email_address: str,
+        subject: str,
+        on_sent: T.Callable[[], None] = None,
+    ):
+        """Queue an email, batched with identical ones queued soon after."""
+        self._start()
+        key = (msg, subject)
+        batch = self._batches.setdefault(key, [])
+        batch.append((email_address, on_sent))
+        if len(batch) >= self.MAX_BATCH:
+            self._flushes.pop(key).cancel()
+            await self._flush(key)
+        elif key not in self._flushes:
+            self._flushes[key] = asyncio.ensure_future(self._flush_later(key))
+
+    async def _flush_later(self, key: T.Tuple[str, str]):
+        await asyncio.sleep(self.batch_window)
+        self._flushes.pop(key, None)
+        await self._flush(key)
+
+    async def _flush(self, key: T.Tuple[str, str]):
+        batch = self._batches.pop(key, [])
+        msg, subject = key
+        if len(batch) > 1 and os.getenv("SENDGRID_FROM_EMAIL"):
+            addresses, callbacks = zip(*batch)
+            await self._queue.put(
+                (notify_emails, (msg, list(addresses), subject), list(callbacks))
+            )
+        else:
+            for address, on_sent in batch:
+                await self._queue.put(
+                    (notify_email, (msg, address, subject), [on_sent])
+                )
+
+    async def close(self):
+        """Send everything queued, then stop the workers."""
+        if self._loop is not asyncio.get_running_loop():
+            return
+        for key, flush in list(self._flushes.items()):
+            flush.cancel()
+            await self._flush(key)
+        self._flushes.clear()
+        await self._queue.join()
+        for worker in self._workers:
+            worker.cancel()
+        self._loop = None
+
+
+DISPATCHER = Dispatcher(
+    workers=int(os.getenv("TXDPS_NOTIFY_WORKERS", 4)),
+    retries=int(os.getenv("TXDPS_NOTIFY_RETRIES", 3)),
+)
+
+
+async def dispatching(coro: T.Awaitable):
+    """Run a coroutine, then wait for the notifications it queued to be sent."""
+    try:
+        return await coro
+    finally:
+        await DISPATCHER.close()
@@ -1,7 +1,10 @@
 """Helpers that pull from DPS API."""
 import asyncio
+import contextlib
 import json
 import logging
+import os
+import time
 import typing as T
 import urllib
 from datetime import datetime
@@ -9,11 +12,145 @@ from datetime import datetime
 import aiohttp
 import pandas as pd
 
+from txdps.cassette import APIResponse, Cassette, request_key
 from txdps.distance import update_distances
+from txdps.fetch import FetchResult, FetchScheduler, RetryableError
 
-BASE_API = "https://publicapi.txdpsscheduler.com/api"
+# point this at e.g. `txdps mock_server` to run against a local stand-in
+BASE_API = os.getenv("TXDPS_API_URL", "https://publicapi.txdpsscheduler.com/api")
 HTTP_HEADERS = {"Origin": "https://public.txdpsscheduler.com"}
 DEFAULT_SERVICE_ID = 71
+LOCATION_COLUMNS = [
+    "Address",
+    "Id",
+    "Name",
+    "NextAvailableDate",
+    "Latitude",
+    "Longitude",
+    "ZipCode",
+    "CityName",
+]
+
+
+class SessionPool:
+    """Lazily create and share one pooled aiohttp session per event loop.
+
+    Every DPS API call made on the same loop goes through the same connector,
+    so TCP and TLS handshakes are only paid once per host instead of once per
+    call. Connection creation and reuse are counted via aiohttp tracing.
+    """
+
+    def __init__(
+        self,
+        keepalive_timeout: float = 30,
+        limit_per_host: int = 20,
+        ttl_dns_cache: int = 300,
+    ):
+        """Configure the pool.
+
+        :param keepalive_timeout: seconds to keep an idle connection open
+        :param limit_per_host: max simultaneous connections to a single host
+        :param ttl_dns_cache: seconds to cache DNS resolutions for
+        """
+        self.keepalive_timeout = keepalive_timeout
+        self.limit_per_host = limit_per_host
+        self.ttl_dns_cache = ttl_dns_cache
+        self.created = 0
+        self.reused = 0
+        self._session = None
+        self._loop = None
+
+    async def _on_create(self, session, ctx, params):
+        self.created += 1
+
+    async def _on_reuse(self, session, ctx, params):
+        self.reused += 1
+
+    @property
+    def reuse_ratio(self) -> float:
+        """Fraction of requests that were served on an already open connection."""
+        total = self.created + self.reused
+        return self.reused / total if total else 0.0
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        """Get the shared session, creating it if needed for the running loop."""
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            trace_config = aiohttp.TraceConfig()
+            trace_config.on_connection_create_end.append(self._on_create)
+            trace_config.on_connection_reuseconn.append(self._on_reuse)
+            connector = aiohttp.TCPConnector(
+                keepalive_timeout=self.keepalive_timeout,
+                limit_per_host=self.limit_per_host,
+                use_dns_cache=True,
+                ttl_dns_cache=self.ttl_dns_cache,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector, trace_configs=[trace_config]
+            )
+            self._loop = loop
+        return self._session
+
+    async def close(self):
+        """Close the shared session and log how often connections were reused."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logging.info(
+                f"Closed DPS API session: {self.created} connections opened, "
+                f"{self.reused} reused ({self.reuse_ratio:.0%})."
+            )
+        self._session = None
+        self._loop = None
+
+
+POOL = SessionPool(
+    keepalive_timeout=float(os.getenv("TXDPS_KEEPALIVE_TIMEOUT", 30)),
+    limit_per_host=int(os.getenv("TXDPS_LIMIT_PER_HOST", 20)),
+    ttl_dns_cache=int(os.getenv("TXDPS_DNS_CACHE_TTL", 300)),
+)
+
+SCHEDULER = FetchScheduler(
+    rate=float(os.getenv("TXDPS_RATE_LIMIT", 20)),
+    max_in_flight=int(os.getenv("TXDPS_MAX_IN_FLIGHT", 10)),
+    retries=int(os.getenv("TXDPS_RETRIES", 3)),
+)
+
+# record API traffic to, or replay it from, a file; see `txdps.cassette`
+CASSETTE = (
+    Cassette(
+        os.environ["TXDPS_CASSETTE"],
+        mode=os.getenv("TXDPS_CASSETTE_MODE", Cassette.REPLAY),
+        speed=float(os.getenv("TXDPS_REPLAY_SPEED", 1)),
+    )
+    if os.getenv("TXDPS_CASSETTE")
+    else None
+)
+
+
+def run(coro: T.Awaitable):
+    """Run a coroutine to completion, then close the shared session.
+
+    Use this instead of `asyncio.run` so that all API calls made by the
+    coroutine share one pool of connections.
+    """
+
+    async def _main():
+        try:
+            return await coro
+        finally:
+            await POOL.close()
+
+    return asyncio.run(_main())
+
+
+@contextlib.contextmanager
+def timed(timings: T.Dict[str, float], stage: str):
+    """Record how long the wrapped block took, in seconds, under `stage`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = time.perf_counter() - start
 
 
 def format_phone(num: int):
@@ -22,6 +159,50 @@ def format_phone(num: int):
     return f"({num_s[:3]}) {num_s[3:6]}-{num_s[6:]}"
 
 
+async def _request(
+    session: aiohttp.ClientSession, method: str, path: str, payload: dict = None
+) -> APIResponse:
+    """Make a request to the DPS API, or replay it if a cassette is loaded.
+
+    The whole body is read as text, whatever the status and content type, so
+    that error details can be pulled from it and it can be recorded as is.
+    """
+    key = request_key(method, path, payload) if CASSETTE is not None else None
+    if CASSETTE is not None and CASSETTE.replaying:
+        return await CASSETTE.replay(key)
+
+    start = time.perf_counter()
+    async with session.request(
+        method, f"{BASE_API}/{path}", json=payload, headers=HTTP_HEADERS
+    ) as res:
+        response = APIResponse(res.status, await res.text())
+
+    if CASSETTE is not None:
+        CASSETTE.record(key, response, time.perf_counter() - start)
+    return response
+
+
+def _raise_for_status(res: APIResponse, msg: str):
+    """Raise if the response failed, flagging throttling and 5xx as retryable.
+
+    Checked before parsing the body, since error pages (e.g. from a proxy in
+    front of the API) aren't necessarily JSON.
+    """
+    if res.ok:
+        return
+
+    try:
+        error_detail = res.json()
+    except ValueError:
+        error_detail = res.text
+    err = {"msg": msg, "error_detail": error_detail}
+    err_str = json.dumps(err)
+    logging.exception(err_str)
+    if res.status == 429 or res.status >= 500:
+        raise RetryableError(err_str)
+    raise Exception(err_str)
+
+
 def pull_zip_town(addr: str) -> T.Tuple[int, str]:
     """Pull the zip code and town name from an address.
 
@@ -61,23 +242,24 @@ async def get_site_info() -> T.Tuple[T.List[dict], int]:
     :return: list of cities, DPS ID for service offered
     """
     logging.info("Fetching scheduler site wide data...")
-    async with aiohttp.ClientSession() as session:
-        async with session.get(f"{BASE_API}/SiteData", headers=HTTP_HEADERS) as res:
-            res_body = await res.json(content_type="text/plain")
-            return [c["Name"] for c in res_body["Cities"]]
+    session = await POOL.get_session()
+    res = await _request(session, "GET", "SiteData")
+    res_body = res.json()
+    return [c["Name"] for c in res_body["Cities"]]
 
 
 async def get_city_info(
-    session, city: str, service_id: int = DEFAULT_SERVICE_ID, zip_code: int = None
-) -> pd.DataFrame:
-    """Get DPS locations with next available date for a service nearest to a specific city.
+    session, city: str, service_id: int = DEFAULT_SERVICE_ID
+) -> T.List[dict]:
+    """Get DPS locations with next available date for a service nearest to a city.
+
+    Records are returned as is; see `parse_locations` to turn them into a frame.
 
     :param session: aiohttp session
     :param city: find next available appointment dates for 5 DPS locations
         nearest this city
     :param service_id: find next available appointment dates for DPS services
         of given ID
-    :param zip_code: find distance from DPS location to this zip code in miles
     """
     logging.info(f"Fetching data for city: '{city}'...")
     payload = {
@@ -89,56 +271,84 @@ async def get_city_info(
         "PreferredDay": 0,
     }
 
-    async with session.post(
-        f"{BASE_API}/AvailableLocation", json=payload, headers=HTTP_HEADERS
-    ) as res:
-        # NB: setting content_type=None removes the Content-Type header check,
-        #     allowing us to extract error details from the response body below
-        res_body = await res.json(content_type=None)
-
-        if not res.ok:
-            err = {
-                "msg": f"Failed to fetch data for city: '{city}'.",
-                "error_detail": res_body,
-            }
-            err_str = json.dumps(err)
-            logging.exception(err_str)
-            raise Exception(err_str)
-
-        logging.info(f"Fetched data for city: '{city}'.")
-
-        df = pd.DataFrame(res_body)
-
-        df[["Latitude", "Longitude"]] = pd.DataFrame(
-            df["MapUrl"].apply(pull_lat_long).tolist(), index=df.index
-        )
-        df[["ZipCode", "CityName"]] = pd.DataFrame(
-            df["Address"].apply(pull_zip_town).tolist(), index=df.index
-        )
-        cols = [
-            "Address",
-            "Id",
-            "Name",
-            "NextAvailableDate",
-            "Latitude",
-            "Longitude",
-            "ZipCode",
-            "CityName",
-        ]
+    res = await _request(session, "POST", "AvailableLocation", payload)
+    _raise_for_status(res, f"Failed to fetch data for city: '{city}'.")
+
+    logging.info(f"Fetched data for city: '{city}'.")
+    return res.json()
 
-        if zip_code:
-            df = update_distances(df, zip_code)
-            cols = cols + ["Distance"]
 
-        df = df[cols]
-        df["NextAvailableDate"] = pd.to_datetime(df["NextAvailableDate"])
-        return df
+def parse_locations(records: T.List[dict], zip_code: int = None) -> pd.DataFrame:
+    """Build a single frame from raw AvailableLocation records.
+
+    Equivalent to applying `pull_lat_long` and `pull_zip_town` to every row,
+    but done with vectorized string operations over all records at once.
+
+    :param records: location records as returned by `get_city_info`
+    :param zip_code: find distance from DPS location to this zip code in miles
+    """
+    cols = LOCATION_COLUMNS + (["Distance"] if zip_code else [])
+    if not records:
+        return pd.DataFrame(columns=cols)
+
+    df = pd.DataFrame.from_records(records)
+    df[["Latitude", "Longitude"]] = (
+        df["MapUrl"].str.extract(r"daddr=(-?[\d.]+),(-?[\d.]+)").astype(float)
+    )
+    # same split as pull_zip_town: the last two space separated tokens
+    df[["CityName", "ZipCode"]] = (
+        df["Address"].str.strip().str.extract(r"(\S+?),?\s+(\S+)$")
+    )
+
+    unparsed = df[df[["Latitude", "CityName"]].isna().any(axis=1)]
+    for addr in unparsed["Address"]:
+        logging.critical(f"Failed to parse address: {addr}")
+
+    if zip_code:
+        df = update_distances(df, zip_code)
+
+    df = df[cols]
+    df["NextAvailableDate"] = pd.to_datetime(df["NextAvailableDate"])
+    return df
+
+
+class LocationCollector:
+    """Collect raw location records from many city lookups, one per location Id.
+
+    Looking up nearby cities mostly returns the same locations, so duplicates
+    are dropped as records arrive instead of after building a frame per city.
+    """
+
+    def __init__(self):
+        """Start with no records."""
+        self._records: T.Dict[int, dict] = {}
+
+    def __len__(self) -> int:
+        """Count unique locations collected so far."""
+        return len(self._records)
+
+    def add(self, records: T.List[dict]) -> T.List[dict]:
+        """Add records, returning the ones for locations not seen before."""
+        new = [r for r in records if r["Id"] not in self._records]
+        self._records.update((r["Id"], r) for r in new)
+        return new
+
+    def to_frame(self, zip_code: int = None) -> pd.DataFrame:
+        """Parse every collected record into one frame."""
+        return parse_locations(list(self._records.values()), zip_code=zip_code)
 
 
 async def get_appointment_info(
-    session, site_name: str, site_id: int, service_id: int = DEFAULT_SERVICE_ID
+    session,
+    site_name: str,
+    site_id: int,
+    service_id: int = DEFAULT_SERVICE_ID,
+    all_slots: bool = False,
 ):
-    """Get specific info on the next available appointment for the given site."""
+    """Get specific info on the next available appointment for the given site.
+
+    :param all_slots: also return every open slot on every date, under "Slots"
+    """
     logging.info(f"Fetching latest appointment data for location: '{site_name}'...")
     payload = {
         "LocationId": site_id,
@@ -148,80 +358,73 @@ async def get_appointment_info(
         "PreferredDay": 0,
     }
 
-    async with session.post(
-        f"{BASE_API}/AvailableLocationDates", json=payload, headers=HTTP_HEADERS
-    ) as res:
-        res_body = await res.json(content_type="text/plain")
-        logging.info(f"Finished fetching appointment data for location: '{site_name}'.")
-
-        first_avail = res_body.get("LocationAvailabilityDates", [{}])[0].get(
-            "AvailableTimeSlots", [{}]
-        )[0]
-        return {
-            "ApptStartDateTime": first_avail.get("StartDateTime"),
-            "ApptEndDateTime": first_avail.get("EndDateTime"),
-            "ApptSlotId": first_avail.get("SlotId"),
-            "ApptDuration": first_avail.get("Duration"),
-            "Id": site_id,
-        }
+    res = await _request(session, "POST", "AvailableLocationDates", payload)
+    _raise_for_status(
+        res, f"Failed to fetch appointment data for location: '{site_name}'."
+    )
+    res_body = res.json()
+    logging.info(f"Finished fetching appointment data for location: '{site_name}'.")
+
+    first_avail = res_body.get("LocationAvailabilityDates", [{}])[0].get(
+        "AvailableTimeSlots", [{}]
+    )[0]
+    appt = {
+        "ApptStartDateTime": first_avail.get("StartDateTime"),
+        "ApptEndDateTime": first_avail.get("EndDateTime"),
+        "ApptSlotId": first_avail.get("SlotId"),
+        "ApptDuration": first_avail.get("Duration"),
+        "Id": site_id,
+    }
+    if all_slots:
+        appt["Slots"] = [
+            slot
+            for day in res_body.get("LocationAvailabilityDates", [])
+            for slot in day.get("AvailableTimeSlots", [])
+        ]
+    return appt
 
 
 async def get_all_cities_info(
-    cities: T.List[str], service_id: int = DEFAULT_SERVICE_ID, zip_code: int = None
-) -> T.List[pd.DataFrame]:
-    """Fetch per-city info concurrently."""
-    async with aiohttp.ClientSession() as session:
-        return await asyncio.gather(
-            *[
-                get_city_info(
-                    session, city=city, service_id=service_id, zip_code=zip_code
-                )
-                for city in cities
-            ]
-        )
-
-
-async def get_all_appts_info(
-    df: pd.DataFrame, service_id: int = DEFAULT_SERVICE_ID
-) -> T.List[pd.DataFrame]:
-    """Fetch per-city info concurrently."""
-    async with aiohttp.ClientSession() as session:
-        return await asyncio.gather(
-            *[
-                get_appointment_info(
-                    session, site_name=row["Name"], site_id=idx, service_id=service_id
-                )
-                for idx, row in df.iterrows()
-            ]
-        )
+    cities: T.List[str], service_id: int = DEFAULT_SERVICE_ID
+) -> T.List[FetchResult]:
+    """Fetch per-city info concurrently, with one result per city."""
+    session = await POOL.get_session()
+    return await asyncio.gather(
+        *[
+            SCHEDULER.fetch(
+                city, get_city_info, session, city=city, service_id=service_id
+            )
+            for city in cities
+        ]
+    )
 
 
 async def cancel(
     conf_num: int, dob: str, first_name: str, last_4_ssn: int, last_name: str
 ):
     """Cancel an existing appointment."""
-    async with aiohttp.ClientSession() as session:
-        res = await session.post(
-            f"{BASE_API}/CancelBooking",
-            json={
-                "ConfirmationNumber": conf_num,
-                "DateOfBirth": dob.strftime("%m/%d/%Y"),
-                "FirstName": first_name,
-                "LastFourDigitsSsn": last_4_ssn,
-                "LastName": last_name,
-            },
-            headers=HTTP_HEADERS,
-        )
-        res_body = await res.text()
-        if not res.ok:
-            err = {
-                "msg": "Failed to cancel appointment",
-                "error_detail": res_body,
-            }
-            err_str = json.dumps(err)
-            logging.exception(err_str)
-            raise Exception(err_str)
-        return json.loads(res_body)
+    session = await POOL.get_session()
+    res = await _request(
+        session,
+        "POST",
+        "CancelBooking",
+        {
+            "ConfirmationNumber": conf_num,
+            "DateOfBirth": dob.strftime("%m/%d/%Y"),
+            "FirstName": first_name,
+            "LastFourDigitsSsn": last_4_ssn,
+            "LastName": last_name,
+        },
+    )
+    if not res.ok:
+        err = {
+            "msg": "Failed to cancel appointment",
+            "error_detail": res.text,
+        }
+        err_str = json.dumps(err)
+        logging.exception(err_str)
+        raise Exception(err_str)
+    return res.json()
 
 
 async def list_appointments(
@@ -239,11 +442,9 @@ async def list_appointments(
         "Last4Ssn": last_4_ssn,
     }
 
-    async with aiohttp.ClientSession() as session:
-        res = await session.post(
-            f"{BASE_API}/Booking", json=payload, headers=HTTP_HEADERS
-        )
-        return await res.json(content_type="text/plain")
+    session = await POOL.get_session()
+    res = await _request(session, "POST", "Booking", payload)
+    return res.json()
 
 
 async def hold(
@@ -258,9 +459,18 @@ async def hold(
     appt_time: str,
     appt_duration: int,
     site_id: int,
+    appts: T.List[dict] = None,
+    timings: T.Dict[str, float] = None,
     **kwargs,
 ):
-    """Book an appointment with the TX DPS."""
+    """Book an appointment with the TX DPS.
+
+    :param appts: existing bookings, as returned by `list_appointments`; if
+        already fetched, passing them saves a round trip between holding the
+        slot and booking it
+    :param timings: if given, filled in with how long each stage took
+    """
+    timings = {} if timings is None else timings
     common = {
         "FirstName": first_name,
         "LastName": last_name,
@@ -285,33 +495,33 @@ async def hold(
         **common,
     }
 
-    async with aiohttp.ClientSession() as session:
-        # reserve the slot
-        res = await session.post(
-            f"{BASE_API}/HoldSlot", json=hold_payload, headers=HTTP_HEADERS
-        )
-        await res.json(content_type="text/plain")
-        logging.debug("Booked appointment.")
-
-        # if you already had an appointment for the same service, you need
-        # to cancel the old one
-        appts = await list_appointments(
-            first_name=first_name,
-            last_name=last_name,
-            dob=dob,
-            last_4_ssn=last_4_ssn,
-        )
-        collision = next(
-            (b for b in appts if b["ServiceTypeId"] == DEFAULT_SERVICE_ID), None
-        )
-        if collision:
-            endpoint = "RescheduleBooking"
-        else:
-            endpoint = "NewBooking"
-        logging.info(f"Using endpoint: {endpoint}")
-
-        # confirm appointment
-        res = await session.post(
-            f"{BASE_API}/{endpoint}", json=book_payload, headers=HTTP_HEADERS
-        )
-        return await res.json(content_type="text/plain")
+    session = await POOL.get_session()
+    # reserve the slot
+    with timed(timings, "hold"):
+        res = await _request(session, "POST", "HoldSlot", hold_payload)
+        res.json()
+    logging.debug("Booked appointment.")
+
+    # if you already had an appointment for the same service, you need
+    # to cancel the old one
+    if appts is None:
+        with timed(timings, "list_appointments"):
+            appts = await list_appointments(
+                first_name=first_name,
+                last_name=last_name,
+                dob=dob,
+                last_4_ssn=last_4_ssn,
+            )
+    collision = next(
+        (b for b in appts if b["ServiceTypeId"] == DEFAULT_SERVICE_ID), None
+    )
+    if collision:
+        endpoint = "RescheduleBooking"
+    else:
+        endpoint = "NewBooking"
+    logging.info(f"Using endpoint: {endpoint}")
+
+    # confirm appointment
+    with timed(timings, "book"):
+        res = await _request(session, "POST", endpoint, book_payload)
+        return res.json()
@@ -0,0 +1,117 @@
+"""Record DPS API traffic to a cassette file and replay it later.
+
+A cassette is an append-only JSON lines file (gzipped if the path ends in
+.gz) with one line per request: when it was made, how long it took, and the
+response. Replaying a cassette serves those responses back, waiting as long
+as the original requests took (divided by the replay speed), so a recorded
+burst of openings can be run through the scan and hold paths deterministically.
+
+NB: request payloads are only stored as a hash, but responses (e.g. bookings)
+are stored as is, so treat cassettes like any other personal data.
+"""
+import asyncio
+import collections
+import gzip
+import hashlib
+import json
+import logging
+import time
+import typing as T
+
+
+class APIResponse(T.NamedTuple):
+    """The parts of an HTTP response the API helpers use."""
+
+    status: int
+    text: str
+
+    @property
+    def ok(self) -> bool:
+        """Whether the status is not an error, like `aiohttp.ClientResponse.ok`."""
+        return self.status < 400
+
+    def json(self) -> T.Any:
+        """Parse the body as JSON, whatever its content type."""
+        return json.loads(self.text) if self.text.strip() else None
+
+
+class CassetteMiss(Exception):
+    """A replayed request that isn't on the cassette."""
+
+
+def request_key(method: str, path: str, payload: T.Any = None) -> str:
+    """Get a compact key identifying a request by its method, path, and payload."""
+    body = json.dumps(payload, sort_keys=True, default=str)
+    digest = hashlib.sha1(body.encode()).hexdigest()[:16]
+    return f"{method} {path} {digest}"
+
+
+def _open(path: str, mode: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t")
+    return open(path, mode)
+
+
+class Cassette:
+    """Record requests to, or replay them from, a cassette file."""
+
+    RECORD = "record"
+    REPLAY = "replay"
+
+    def __init__(self, path: str, mode: str, speed: float = 1.0):
+        """Open a cassette.
+
+        :param path: cassette file
+        :param mode: 'record' to append requests, 'replay' to serve them back
+        :param speed: when replaying, how many times faster than the original
+            responses to respond; 0 responds immediately
+        """
+        if mode not in (self.RECORD, self.REPLAY):
+            raise ValueError(f"Unrecognized cassette mode: {mode}")
+
+        self.path = path
+        self.mode = mode
+        self.speed = speed
+        self._start = time.time()
+        self._tapes: T.Dict[str, T.Deque[dict]] = collections.defaultdict(
+            collections.deque
+        )
+
+        if mode == self.REPLAY:
+            with _open(path, "r") as f:
+                entries = [json.loads(line) for line in f if line.strip()]
+            for entry in entries:
+                self._tapes[entry["k"]].append(entry)
+            logging.info(f"Loaded {len(entries)} recorded requests from {path}")
+
+    @property
+    def replaying(self) -> bool:
+        """Whether responses should come from the cassette."""
+        return self.mode == self.REPLAY
+
+    def record(self, key: str, response: APIResponse, elapsed: float):
+        """Append a request's response and how long it took."""
+        entry = {
+            "t": round(time.time() - self._start, 4),
+            "k": key,
+            "d": round(elapsed, 4),
+            "s": response.status,
+            "b": response.text,
+        }
+        with _open(self.path, "a") as f:
+            f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+    async def replay(self, key: str) -> APIResponse:
+        """Serve the next recorded response for the request.
+
+        Responses for a request are served in the order recorded; once only
+        the last one is left it's served for any further identical requests.
+        """
+        tape = self._tapes.get(key)
+        if not tape:
+            raise CassetteMiss(f"No recorded response for request: {key}")
+
+        entry = tape.popleft() if len(tape) > 1 else tape[0]
+        if self.speed:
+            await asyncio.sleep(entry["d"] / self.speed)
+        return APIResponse(entry["s"], entry["b"])
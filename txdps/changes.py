@@ -0,0 +1,73 @@
+"""Diff consecutive location snapshots into a compact change feed.
+
+Consumers (the web app, search indexing, alerting) can apply just the changes
+instead of reloading and rescanning the whole snapshot.
+"""
+import typing as T
+
+import pandas as pd
+
+APPEARED = "appeared"
+DISAPPEARED = "disappeared"
+EARLIER = "earlier"
+LATER = "later"
+
+
+def _next_dates(df: pd.DataFrame) -> T.Dict[int, T.Optional[pd.Timestamp]]:
+    ids = df["Id"] if "Id" in df else df.index
+    dates = pd.to_datetime(df["NextAvailableDate"])
+    return {int(i): None if pd.isna(d) else d for i, d in zip(ids, dates)}
+
+
+def _isoformat(d: T.Optional[pd.Timestamp]) -> T.Optional[str]:
+    return None if d is None else d.isoformat()
+
+
+def diff_snapshots(prev: pd.DataFrame, curr: pd.DataFrame) -> T.List[dict]:
+    """Get which locations appeared, disappeared, or moved their next date.
+
+    Snapshots may have Id as a column or as the index. A location with no next
+    available date before but one now counts as having moved earlier.
+
+    Usage:
+    >>> prev = pd.DataFrame({"Id": [1, 2, 3], "NextAvailableDate": [
+    ...     "2020-07-02", "2020-07-03", "2020-07-04"]})
+    >>> curr = pd.DataFrame({"Id": [2, 3, 4], "NextAvailableDate": [
+    ...     "2020-07-01", "2020-07-04", "2020-07-05"]})
+    >>> [(c["Id"], c["Change"]) for c in diff_snapshots(prev, curr)]
+    [(2, 'earlier'), (4, 'appeared'), (1, 'disappeared')]
+    """
+    before = _next_dates(prev)
+    after = _next_dates(curr)
+    changes = []
+
+    for location_id, date in after.items():
+        if location_id not in before:
+            change = APPEARED
+        else:
+            old = before[location_id]
+            if old == date:
+                continue
+            moved_earlier = old is None or (date is not None and date < old)
+            change = EARLIER if moved_earlier else LATER
+        changes.append(
+            {
+                "Id": location_id,
+                "Change": change,
+                "From": _isoformat(before.get(location_id)),
+                "To": _isoformat(date),
+            }
+        )
+
+    for location_id, date in before.items():
+        if location_id not in after:
+            changes.append(
+                {
+                    "Id": location_id,
+                    "Change": DISAPPEARED,
+                    "From": _isoformat(date),
+                    "To": None,
+                }
+            )
+
+    return changes
@@ -1,6 +1,7 @@
 """CLI entrypoint."""
 import argparse
 import importlib
+import os
 import re
 import sys
 from datetime import datetime
@@ -13,6 +14,18 @@ def parse_date(s: str):
     return datetime.strptime(s, "%Y-%m-%d")
 
 
+def parse_weekdays(s: str):
+    """Get weekday numbers (Monday is 0) from e.g. a 'mon,wed,fri' string."""
+    days = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+    return [days.index(d.strip().lower()[:3]) for d in s.split(",")]
+
+
+def parse_hours(s: str):
+    """Get a [from, to) range of hours of the day from e.g. a '13-17' string."""
+    start, end = map(int, s.split("-"))
+    return start, end
+
+
 def get_parser():
     """Get a parser for pulling CLI arguments."""
     parser = argparse.ArgumentParser(
@@ -115,18 +128,177 @@ def get_parser():
         "cache_file": dict(
             flag="--cache-file",
             default="locations.csv",
-            help="Write available dates per location to local CSV file at this path",
+            help=(
+                "Write available dates per location to this local file; "
+                "end it in .parquet or .arrow for a typed, compressed snapshot"
+            ),
         ),
         "uri": dict(
             flag="--uri",
             required=True,
-            help="S3 URI to read/write fetched appointment data from/to",
+            help=(
+                "S3 URI to read/write fetched appointment data from/to; "
+                "the format (.csv, .parquet, or .arrow) follows the extension"
+            ),
         ),
         "interval": dict(
             flag="--interval",
             default=10,
-            help="How often (in mins) to run the scheduled pull",
+            help="How often (in mins) to run the scheduled pull or scan",
+            type=int,
+        ),
+        "fast_hold": dict(
+            flag="--fast-hold",
+            action="store_true",
+            help="Hold slots as soon as they're found instead of after a full scan",
+        ),
+        "max_candidates": dict(
+            flag="--max-candidates",
+            type=int,
+            default=3,
+            help="If holding a slot fails, try up to this many slots in total",
+        ),
+        "daemon": dict(
+            flag="--daemon",
+            action="store_true",
+            help="Keep running, repeating every --interval min, instead of once",
+        ),
+        "jitter": dict(
+            flag="--jitter",
+            default=30,
+            help="Randomly shift each --daemon run by up to this many seconds",
+            type=int,
+        ),
+        "subscriptions": dict(
+            flag="--subscriptions",
+            required=True,
+            help="JSON file or SQLite DB of subscriptions to watch for",
+        ),
+        "all_slots": dict(
+            flag="--all-slots",
+            action="store_true",
+            help="Look up and print every open slot, not just the next at each one",
+        ),
+        "weekdays": dict(
+            flag="--weekdays",
+            type=parse_weekdays,
+            help="Only match slots on these days, e.g. mon,wed,fri",
+        ),
+        "hours": dict(
+            flag="--hours",
+            type=parse_hours,
+            help="Only match slots starting in this range of hours, e.g. 13-17",
+        ),
+        "history_dir": dict(
+            flag="--history-dir",
+            default=os.getenv("TXDPS_HISTORY_DIR", "history"),
+            help="Directory availability history is recorded to (TXDPS_HISTORY_DIR)",
+        ),
+        "location_ids": dict(
+            flag="--location-ids",
+            nargs="*",
+            type=int,
+            default=[],
+            help="Only look at DPS locations with these IDs",
+        ),
+        "since": dict(
+            flag="--since",
+            type=parse_date,
+            help="Only look at history from this date on, as YYYY-MM-DD",
+        ),
+        "until": dict(
+            flag="--until",
+            type=parse_date,
+            help="Only look at history from before this date, as YYYY-MM-DD",
+        ),
+        "summary": dict(
+            flag="--summary",
+            action="store_true",
+            help="Summarize how often each location's availability changed",
+        ),
+        "state_db": dict(
+            flag="--state-db",
+            default=os.getenv("TXDPS_STATE_DB"),
+            help=(
+                "SQLite DB remembering slots already notified on, so only new "
+                "slots are notified on again (TXDPS_STATE_DB)"
+            ),
+        ),
+        "zip_table": dict(
+            flag="--out",
+            dest="out",
+            help=(
+                "Write the zip code table to this .npy file; defaults to "
+                "TXDPS_ZIP_TABLE, where it's read from, or else in the package"
+            ),
+        ),
+        "zip_source": dict(
+            flag="--source",
+            dest="source",
+            help=(
+                "CSV/TSV/JSON of zip codes and lat/longs, e.g. the Census ZCTA "
+                "gazetteer; if not given, the uszipcode DB is dumped"
+            ),
+        ),
+        "priority_subscriptions": dict(
+            flag="--subscriptions",
+            dest="subscriptions",
+            help="JSON file or SQLite DB of subscriptions to refresh nearby first",
+        ),
+        "adaptive": dict(
+            flag="--adaptive",
+            action="store_true",
+            help=(
+                "Pull more often, each time only refreshing the locations whose "
+                "availability changes most, at the same overall request rate"
+            ),
+        ),
+        "ticks": dict(
+            flag="--ticks",
+            type=int,
+            default=5,
+            help="With --adaptive, how many pulls to spread each --interval over",
+        ),
+        "port": dict(
+            flag="--port", type=int, default=8100, help="Serve on this port"
+        ),
+        "n_cities": dict(
+            flag="--n-cities",
             type=int,
+            default=250,
+            help="Number of synthetic cities to generate",
+        ),
+        "n_locations": dict(
+            flag="--n-locations",
+            type=int,
+            default=100,
+            help="Number of synthetic DPS locations to generate",
+        ),
+        "latency": dict(
+            flag="--latency",
+            type=float,
+            default=0.0,
+            help="Delay every response by this many seconds",
+        ),
+        "latency_jitter": dict(
+            flag="--latency-jitter",
+            type=float,
+            default=0.0,
+            help="Delay every response by up to this many more seconds at random",
+        ),
+        "error_rate": dict(
+            flag="--error-rate",
+            type=float,
+            default=0.0,
+            help="Fraction of requests to fail with a 500",
+        ),
+        "rate_limit": dict(
+            flag="--rate-limit",
+            type=float,
+            help="Respond with a 429 to requests over this many per second",
+        ),
+        "seed": dict(
+            flag="--seed", type=int, default=0, help="Random seed for synthetic data"
         ),
         "n": dict(
             flag="-n",
@@ -136,11 +308,16 @@ def get_parser():
     }
     notify_args = (
         "cities",
+        "daemon",
         "email_address",
+        "hours",
+        "interval",
+        "jitter",
         "max_date",
         "max_dist",
         "min_date",
         "phone_number",
+        "weekdays",
         "zip_code",
     )
     hold_args = (
@@ -160,7 +337,7 @@ def get_parser():
     cmd_args = {
         "schedule": {
             "help": "Like pull_and_upload, but run on a schedule",
-            "args": ("uri", "interval"),
+            "args": ("uri", "interval", "adaptive", "ticks", "priority_subscriptions"),
         },
         "cancel": {
             "help": "Cancel a DPS appointment appointment",
@@ -178,7 +355,7 @@ def get_parser():
                 "Search for a slot matching the given criteria. If one is found "
                 "book it right away and send a phone and/or email notification"
             ),
-            "args": set(hold_args + notify_args)
+            "args": set(hold_args + notify_args + ("fast_hold", "max_candidates"))
             - {"slot_id", "site_id", "appt_time", "appt_duration"},
         },
         "notify": {
@@ -186,14 +363,29 @@ def get_parser():
                 "Search for a slot matching the given criteria. If one is found "
                 "send a phone or email notification"
             ),
-            "args": notify_args,
+            "args": notify_args + ("state_db",),
+        },
+        "watch": {
+            "help": (
+                "Search for slots matching any of many subscribers' criteria "
+                "in one scan, and notify each subscriber of their matches"
+            ),
+            "args": ("subscriptions", "daemon", "interval", "jitter", "state_db"),
         },
         "pull": {
             "help": (
                 "Finds the next available date for a new Driver License "
                 "appointment in Texas DPS locations."
             ),
-            "args": ("use_cache", "cache_file", "cities", "zip_code", "max_dist", "n"),
+            "args": (
+                "use_cache",
+                "cache_file",
+                "cities",
+                "zip_code",
+                "max_dist",
+                "n",
+                "all_slots",
+            ),
         },
         "pull_and_upload": {
             "help": (
@@ -202,6 +394,33 @@ def get_parser():
             ),
             "args": ("uri",),
         },
+        "history": {
+            "help": (
+                "Show how locations' next available dates changed over time, "
+                "as recorded by pulls with TXDPS_HISTORY_DIR set"
+            ),
+            "args": ("history_dir", "location_ids", "since", "until", "summary", "n"),
+        },
+        "mock_server": {
+            "help": (
+                "Serve a local stand-in for the DPS API with synthetic data. "
+                "Set TXDPS_API_URL to http://localhost:<port>/api to use it"
+            ),
+            "args": (
+                "port",
+                "n_cities",
+                "n_locations",
+                "latency",
+                "latency_jitter",
+                "error_rate",
+                "rate_limit",
+                "seed",
+            ),
+        },
+        "build_zip_table": {
+            "help": "Build the offline zip code -> lat/long table used for distances",
+            "args": ("zip_table", "zip_source"),
+        },
         "create_index": {"help": "Setup search index in Algolia.", "args": ("uri",)},
         "run_web": {"help": "Run web frontend.", "args": ()},
     }
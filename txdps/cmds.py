@@ -4,20 +4,39 @@ import functools
 import logging
 import os
 import sys
+import time
 import typing as T
 from datetime import datetime, timedelta
 
 import pandas as pd
+from aiohttp import web
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.schedulers.blocking import BlockingScheduler
 from tabulate import tabulate
 
-from txdps.alerts import notify_email, notify_phone
+from txdps.alerts import DISPATCHER, dispatching
 from txdps.api import cancel as _cancel
-from txdps.api import get_all_appts_info, get_all_cities_info, get_site_info
 from txdps.api import hold as _hold
 from txdps.api import list_appointments as _list_appointments
+from txdps.api import run
 from txdps.app import run as run_web
+from txdps.distance import DISTANCE_MATRIX_PATH, ZIP_TABLE_PATH, build_distance_matrix
+from txdps.history import HistoryStore
+from txdps.mockserver import MockScheduler
+from txdps.mockserver import create_app as create_mock_app
+from txdps.refresh import AdaptivePoller, locations_near
+from txdps.scan import (
+    PLANNER,
+    fetch_locations,
+    fetch_slot_table,
+    find_matching_slots,
+    stream_matching_slots,
+)
 from txdps.search import create_index
+from txdps.snapshot import publish_snapshot, read_snapshot, write_snapshot
+from txdps.state import SeenSlots
+from txdps.watch import load_index, scan_for_subscribers
+from txdps.zipcodes import build_zip_table as _build_zip_table
 
 
 def _pretty_print(df: pd.DataFrame, n: int):
@@ -28,28 +47,45 @@ def _pretty_print(df: pd.DataFrame, n: int):
     return s
 
 
+# record every refresh here, if set; see `history`
+HISTORY_DIR = os.getenv("TXDPS_HISTORY_DIR")
+
+
+def _record_history(df: pd.DataFrame):
+    if HISTORY_DIR:
+        HistoryStore(HISTORY_DIR).append(df)
+
+
 def _refresh_df(cities: T.List[str] = None, zip_code: int = None) -> pd.DataFrame:
     """Pull DPS and appointment info from the API and return in dataframe."""
-    if not cities:
-        cities = asyncio.run(get_site_info())
-
-    # load most of the data we need here
-    all_dfs = asyncio.run(get_all_cities_info(cities=cities, zip_code=zip_code))
-    # since looking up all locations nearest to a specific city can return
-    # the same location for 2 different cities, deduplicate on DPS location id
-    return (
-        pd.concat(all_dfs)
-        .set_index("Id")
-        .drop_duplicates()
-        .sort_values("NextAvailableDate")
-    )
+    df = run(fetch_locations(cities=cities, zip_code=zip_code))
+    _record_history(df)
+    return df
+
+
+def _upload_df(df: pd.DataFrame, uri: str):
+    if publish_snapshot(df, uri):
+        logging.info(f"Updated file at URI with {len(df)} rows: {uri}")
+    if DISTANCE_MATRIX_PATH:
+        build_distance_matrix(DISTANCE_MATRIX_PATH, df)
 
 
 def pull_and_upload(uri: str):
     """Pull latest DPS appointment data and reupload to S3."""
-    df = _refresh_df()
-    df.to_csv(uri)
-    logging.info(f"Updated file at URI with {len(df)} rows: {uri}")
+    _upload_df(_refresh_df(), uri)
+
+
+def _adaptive_pull_and_upload(
+    poller: AdaptivePoller, uri: str, ticks: int, subscriptions: str = None
+):
+    hot = set()
+    if subscriptions:
+        hot = locations_near(
+            PLANNER.location_coords, load_index(subscriptions).origin_radii()
+        )
+    df = run(poller.refresh(ticks=ticks, hot=hot))
+    _record_history(df)
+    _upload_df(df, uri)
 
 
 def pull(
@@ -59,15 +95,27 @@ def pull(
     zip_code: int,
     max_dist: float,
     n: int,
+    all_slots: bool = False,
 ):
     """Pull DPS and appointment info from cache file or API and pretty print."""
+    if all_slots:
+        df, slots = run(
+            fetch_slot_table(
+                cities=cities,
+                zip_code=zip_code,
+                max_dist=max_dist if max_dist > 0 else None,
+            )
+        )
+        locations = df[[c for c in ("Name", "Distance") if c in df]]
+        _pretty_print(slots.to_frame().join(locations, on="Id"), n)
+        return
+
     if use_cache:
         logging.info(f"Using cache at {cache_file}")
-        df = pd.read_csv(cache_file)
-        df["NextAvailableDate"] = pd.to_datetime(df["NextAvailableDate"])
+        df = read_snapshot(cache_file)
     else:
         df = _refresh_df(cities=cities, zip_code=zip_code)
-        df.to_csv(cache_file)
+        write_snapshot(df, cache_file)
 
     if max_dist > 0:
         logging.info(f"Limiting to locations within {max_dist} miles.")
@@ -76,8 +124,31 @@ def pull(
     _pretty_print(df, n)
 
 
-def notify_slot(df: pd.DataFrame, phone_number: int, email_address: str):
-    """Send email or SMS messages that new DPS slots have opened up."""
+def history(
+    history_dir: str,
+    location_ids: T.List[int],
+    since: datetime,
+    until: datetime,
+    summary: bool,
+    n: int,
+):
+    """Print recorded changes in availability, or a summary per location."""
+    store = HistoryStore(history_dir)
+    query = {"start": since, "end": until, "location_ids": location_ids or None}
+    df = store.summarize(**query) if summary else store.series(**query)
+    _pretty_print(df, n)
+
+
+async def notify_slot(
+    df: pd.DataFrame,
+    phone_number: int,
+    email_address: str,
+    on_sent: T.Callable[[], None] = None,
+):
+    """Queue email or SMS messages that new DPS slots have opened up.
+
+    :param on_sent: called whenever one of the messages has been sent
+    """
     if df is None or not len(df):
         logging.info("No slots matching criteria to notify on.")
         return
@@ -108,45 +179,46 @@ def notify_slot(df: pd.DataFrame, phone_number: int, email_address: str):
     logging.info(msg)
 
     if phone_number:
-        notify_phone(msg=msg, phone_number=phone_number)
+        await DISPATCHER.send_sms(
+            msg=msg, phone_number=phone_number, on_sent=on_sent
+        )
 
     if email_address:
-        notify_email(
+        await DISPATCHER.send_email(
             msg=msg,
             email_address=email_address,
             subject="New Texas DPS Appointments Available",
+            on_sent=on_sent,
         )
 
 
-def _find_matching_slots(
-    cities: T.List[str],
-    zip_code: int,
-    max_dist: float,
-    min_date: datetime.date,
-    max_date: datetime.date,
+# how long to suppress repeat notifications of the same slots for
+STATE_TTL_HOURS = float(os.getenv("TXDPS_STATE_TTL_HOURS", 24))
+
+
+async def _notify_unseen(
+    df: pd.DataFrame,
     phone_number: int,
     email_address: str,
-    **kwargs,
+    subscriber: str,
+    state_db: str = None,
 ):
-    df = _refresh_df(cities=cities, zip_code=zip_code)
-    df["NextAvailableDate"] = pd.to_datetime(df["NextAvailableDate"])
-    df = df[
-        (df.NextAvailableDate > min_date)
-        & (df.NextAvailableDate < max_date)
-        & (df["Distance"] <= max_dist)
-    ]
-
-    if not len(df):
-        logging.info("No appointments found.")
-        return
-
-    appt_dicts = asyncio.run(get_all_appts_info(df=df))
-    df2 = pd.DataFrame(appt_dicts).set_index("Id")
-    df3 = df.join(df2, lsuffix="", rsuffix="")
-    return df3
+    """Notify of slots, skipping any already notified on if given a state DB."""
+    if not state_db:
+        return await notify_slot(df, phone_number, email_address)
+
+    seen = SeenSlots(state_db, ttl_hours=STATE_TTL_HOURS)
+    df = seen.unseen(subscriber, df)
+    # only suppress the slots once the subscriber was actually told of them
+    await notify_slot(
+        df,
+        phone_number,
+        email_address,
+        on_sent=functools.partial(seen.mark, subscriber, df),
+    )
 
 
-def notify(
+async def _notify(
     cities: T.List[str],
     zip_code: int,
     max_dist: float,
@@ -154,23 +226,65 @@ def notify(
     max_date: datetime.date,
     phone_number: int,
     email_address: str,
+    weekdays: T.List[int] = None,
+    hours: T.Tuple[int, int] = None,
+    state_db: str = None,
     **kwargs,
 ):
-    """Pull latest DPS appt info, limit using criteria, and notify on match."""
-    df = _find_matching_slots(
+    df = await find_matching_slots(
         cities=cities,
         zip_code=zip_code,
         max_dist=max_dist,
         min_date=min_date,
         max_date=max_date,
-        phone_number=phone_number,
-        email_address=email_address,
+        weekdays=weekdays,
+        hours=hours,
     )
 
-    return notify_slot(df, phone_number, email_address)
+    return await _notify_unseen(
+        df,
+        phone_number,
+        email_address,
+        subscriber=f"{phone_number}:{email_address}",
+        state_db=state_db,
+    )
 
 
-def scan_and_autohold(
+def notify(daemon: bool = False, interval: int = 10, jitter: int = 30, **kwargs):
+    """Pull latest DPS appt info, limit using criteria, and notify on match."""
+    if daemon:
+        return _run_daemon(functools.partial(_notify, **kwargs), interval, jitter)
+    return run(dispatching(_notify(**kwargs)))
+
+
+async def _watch(subscriptions: str, state_db: str = None):
+    index = load_index(subscriptions)
+    matches = await scan_for_subscribers(index)
+    for sub, slots in matches.items():
+        await _notify_unseen(
+            pd.DataFrame(slots).set_index("Id"),
+            sub.phone_number,
+            sub.email_address,
+            subscriber=sub.id,
+            state_db=state_db,
+        )
+
+
+def watch(
+    subscriptions: str,
+    daemon: bool = False,
+    interval: int = 10,
+    jitter: int = 30,
+    state_db: str = None,
+):
+    """Scan once for many subscribers and notify each of their matching slots."""
+    job = functools.partial(_watch, subscriptions=subscriptions, state_db=state_db)
+    if daemon:
+        return _run_daemon(job, interval, jitter)
+    return run(dispatching(job()))
+
+
+async def _scan_and_autohold(
     cities: T.List[str],
     zip_code: int,
     max_dist: float,
@@ -183,18 +297,37 @@ def scan_and_autohold(
     card_number: int,
     phone_number: int,
     email_address: str,
+    fast_hold: bool = False,
+    max_candidates: int = 3,
+    weekdays: T.List[int] = None,
+    hours: T.Tuple[int, int] = None,
     **kwargs,
 ):
-    """Pull latest DPS appt info, limit using criteria, and notify on match."""
-    if not max_date:
-        appts = asyncio.run(
-            _list_appointments(
-                first_name=first_name,
-                last_name=last_name,
-                dob=dob,
-                last_4_ssn=last_4_ssn,
-            )
+    timings = {}
+    start = time.perf_counter()
+    personal = {
+        "first_name": first_name,
+        "last_name": last_name,
+        "dob": dob,
+        "last_4_ssn": last_4_ssn,
+        "card_number": card_number,
+        "email_address": email_address,
+        "phone_number": phone_number,
+    }
+
+    # existing bookings are needed to pick the booking endpoint anyway, so
+    # fetch them while scanning instead of in between holding and booking
+    appts_task = asyncio.ensure_future(
+        _list_appointments(
+            first_name=first_name,
+            last_name=last_name,
+            dob=dob,
+            last_4_ssn=last_4_ssn,
         )
+    )
+
+    if not max_date:
+        appts = await appts_task
 
         # HACK
         if os.getenv("APPLY_PLANO_HACK") is not None:
@@ -209,66 +342,137 @@ def scan_and_autohold(
         else:
             max_date = datetime.date(datetime.now()) + timedelta(months=1)
 
-    df = _find_matching_slots(
-        cities=cities,
-        zip_code=zip_code,
-        max_dist=max_dist,
-        min_date=min_date,
-        max_date=max_date,
-        phone_number=phone_number,
-        email_address=email_address,
-    )
+    criteria = {
+        "cities": cities,
+        "zip_code": zip_code,
+        "max_dist": max_dist,
+        "min_date": min_date,
+        "max_date": max_date,
+        "weekdays": weekdays,
+        "hours": hours,
+    }
+
+    if fast_hold:
+        # try to hold slots in the order they're found, without waiting for
+        # the rest of the scan to finish
+        candidates = stream_matching_slots(**criteria)
+    else:
+        df = await find_matching_slots(**criteria)
+        timings["scan"] = time.perf_counter() - start
+
+        if df is None or not len(df):
+            logging.info("No slots matching criteria. Nothing to hold")
+            appts_task.cancel()
+            return
+
+        # use whatever DPS location is closest
+        candidates = _iterate(
+            df.sort_values("Distance", ascending=True)
+            .reset_index()
+            .to_dict(orient="records")
+        )
 
-    if df is None or not len(df):
+    res = None
+    tried = 0
+    try:
+        async for appt in candidates:
+            timings.setdefault("scan", time.perf_counter() - start)
+            res = await _hold(
+                appt_time=appt["ApptStartDateTime"],
+                appt_duration=appt["ApptDuration"],
+                site_id=appt["Id"],
+                slot_id=appt["ApptSlotId"],
+                appts=await appts_task,
+                timings=timings,
+                **personal,
+            )
+            tried += 1
+            _log_timings(timings, start)
+
+            if res.get("ErrorMessage") is None or tried >= max_candidates:
+                break
+
+            logging.warning(
+                f"Failed to hold slot {appt['ApptSlotId']} at '{appt['Name']}': "
+                f"{res['ErrorMessage']}. Trying next candidate..."
+            )
+    finally:
+        appts_task.cancel()
+        if fast_hold:
+            await candidates.aclose()
+
+    if res is None:
         logging.info("No slots matching criteria. Nothing to hold")
         return
 
-    # use whatever DPS location is closest
-    best_appt = (
-        df.sort_values("Distance", ascending=True)
-        .head(1)
-        .reset_index()
-        .to_dict(orient="records")[0]
+    return await _report_hold(
+        res, phone_number=phone_number, email_address=email_address
     )
 
-    return hold(
-        first_name=first_name,
-        last_name=last_name,
-        dob=dob,
-        last_4_ssn=last_4_ssn,
-        card_number=card_number,
-        email_address=email_address,
-        phone_number=phone_number,
-        appt_time=best_appt["ApptStartDateTime"],
-        appt_duration=best_appt["ApptDuration"],
-        site_id=best_appt["Id"],
-        slot_id=best_appt["ApptSlotId"],
+
+async def _iterate(items: T.Iterable) -> T.AsyncIterator:
+    for item in items:
+        yield item
+
+
+def _log_timings(timings: T.Dict[str, float], start: float):
+    stages = ", ".join(f"{k}={v:.3f}s" for k, v in timings.items())
+    logging.info(
+        f"Autohold timings: {stages} (total {time.perf_counter() - start:.3f}s)"
     )
 
 
+async def _autohold_until_booked(max_date: datetime.date = None, **kwargs) -> bool:
+    booking = await _scan_and_autohold(max_date=max_date, **kwargs)
+    # without a max date, each run only books slots earlier than the current
+    # booking, so keep going; otherwise we'd keep rebooking within the window
+    return booking is not None and max_date is not None
+
+
+def scan_and_autohold(
+    daemon: bool = False, interval: int = 10, jitter: int = 30, **kwargs
+):
+    """Pull latest DPS appt info, limit using criteria, and hold best match."""
+    if daemon:
+        return _run_daemon(
+            functools.partial(_autohold_until_booked, **kwargs), interval, jitter
+        )
+    return run(dispatching(_scan_and_autohold(**kwargs)))
+
+
 def cancel(conf_num: int, dob: str, first_name: str, last_4_ssn: int, last_name: str):
     """Cancel a DPS appointment booking."""
-    res = asyncio.run(_cancel(conf_num, dob, first_name, last_4_ssn, last_name))
+    res = run(_cancel(conf_num, dob, first_name, last_4_ssn, last_name))
     logging.info(f"Appointment {conf_num} cancelled. {res}")
 
 
-def hold(phone_number: int, email_address: str, **kwargs):
-    """Reserve an appointment."""
-    res = asyncio.run(
-        _hold(phone_number=phone_number, email_address=email_address, **kwargs)
+async def _hold_and_report(phone_number: int, email_address: str, **kwargs):
+    res = await _hold(phone_number=phone_number, email_address=email_address, **kwargs)
+    return await _report_hold(
+        res, phone_number=phone_number, email_address=email_address
     )
 
-    def report(msg: str, subject: str = None):
+
+async def _report_hold(res: dict, phone_number: int, email_address: str):
+    """Notify on the outcome of booking a slot, raising if it failed.
+
+    Notifications are only queued here, so sending them never holds up
+    trying the next slot.
+    """
+
+    async def report(msg: str, subject: str = None):
         if phone_number:
-            notify_phone(msg=msg, phone_number=phone_number)
+            await DISPATCHER.send_sms(msg=msg, phone_number=phone_number)
 
         if email_address:
-            notify_email(msg=msg, email_address=email_address, subject=subject)
+            await DISPATCHER.send_email(
+                msg=msg, email_address=email_address, subject=subject
+            )
 
     if res.get("ErrorMessage") is not None:
         msg = f"Almost! Failed to book appointment.\n\n{res['ErrorMessage']}"
         logging.fatal(msg)
-        report(msg)
+        await report(msg)
         raise ValueError(msg)
 
     conf_num = res["Booking"]["ConfirmationNumber"]
@@ -277,14 +481,49 @@ def hold(phone_number: int, email_address: str, **kwargs):
 Confirmation number is {conf_num}; use this to cancel.
 """
     logging.info(msg)
-    report(msg=msg, subject="TxDPS appointment booked")
+    await report(msg=msg, subject="TxDPS appointment booked")
+    return res["Booking"]
+
+
+def hold(phone_number: int, email_address: str, **kwargs):
+    """Reserve an appointment."""
+    return run(
+        dispatching(
+            _hold_and_report(
+                phone_number=phone_number, email_address=email_address, **kwargs
+            )
+        )
+    )
 
 
-def schedule(interval: int, **kwargs):
-    """Start a long running process to re-run the data pull every <interval> min."""
+def schedule(
+    interval: int,
+    adaptive: bool = False,
+    ticks: int = 5,
+    subscriptions: str = None,
+    **kwargs,
+):
+    """Start a long running process to re-run the data pull every <interval> min.
+
+    In adaptive mode, instead pull <ticks> times as often, each time only
+    refreshing the most volatile locations (and those near any subscribers),
+    for the same overall request rate.
+    """
     sched = BlockingScheduler()
-    fn = functools.partial(pull_and_upload, **kwargs)
-    sched.add_job(fn, "interval", minutes=interval)
+    if adaptive:
+        fn = functools.partial(
+            _adaptive_pull_and_upload,
+            AdaptivePoller(full_sweep_hours=PLANNER.full_sweep_hours),
+            ticks=ticks,
+            subscriptions=subscriptions,
+            **kwargs,
+        )
+        sched.add_job(
+            fn, "interval", minutes=interval / ticks, next_run_time=datetime.now()
+        )
+    else:
+        fn = functools.partial(pull_and_upload, **kwargs)
+        sched.add_job(fn, "interval", minutes=interval)
 
     try:
         sched.start()
@@ -292,14 +531,86 @@ def schedule(interval: int, **kwargs):
         sys.exit(0)
 
 
+def build_zip_table(out: str = None, source: str = None):
+    """Build the offline zip code centroid table."""
+    out = out or ZIP_TABLE_PATH
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    table = _build_zip_table(out, source=source)
+    logging.info(f"Zip code table at {out} has {len(table)} zip codes.")
+
+
+def mock_server(
+    port: int,
+    n_cities: int,
+    n_locations: int,
+    latency: float,
+    latency_jitter: float,
+    error_rate: float,
+    rate_limit: float,
+    seed: int,
+):
+    """Serve a local stand-in for the DPS scheduler API."""
+    scheduler = MockScheduler(n_cities=n_cities, n_locations=n_locations, seed=seed)
+    app = create_mock_app(
+        scheduler,
+        latency=latency,
+        latency_jitter=latency_jitter,
+        error_rate=error_rate,
+        rate_limit=rate_limit,
+    )
+    web.run_app(app, port=port)
+
+
+def _run_daemon(job: T.Callable[[], T.Awaitable], interval: int, jitter: int):
+    """Run an async job every <interval> min (+/- <jitter> sec) on one event loop.
+
+    Unlike re-running the CLI, the DPS API session, coverage plan, and zip code
+    lookups all stay warm between runs. Runs never overlap; if one is still
+    going when the next is due, the next is skipped. Stops once the job returns
+    something truthy.
+    """
+
+    async def main():
+        stopped = asyncio.Event()
+
+        async def tick():
+            if await job():
+                stopped.set()
+
+        sched = AsyncIOScheduler(event_loop=asyncio.get_running_loop())
+        sched.add_job(
+            tick,
+            "interval",
+            minutes=interval,
+            jitter=jitter,
+            max_instances=1,
+            coalesce=True,
+            next_run_time=datetime.now(),
+        )
+        sched.start()
+        try:
+            await stopped.wait()
+        finally:
+            sched.shutdown(wait=False)
+
+    try:
+        run(dispatching(main()))
+    except KeyboardInterrupt:
+        sys.exit(0)
+
+
 __all__ = [
+    "build_zip_table",
     "cancel",
     "create_index",
+    "history",
     "hold",
+    "mock_server",
     "notify",
     "pull",
     "pull_and_upload",
     "run_web",
     "scan_and_autohold",
     "schedule",
+    "watch",
 ]
@@ -0,0 +1,158 @@
+"""Plan the smallest set of cities to query that still covers every DPS location.
+
+Looking up a city returns the 5 DPS locations nearest to it, so neighbouring
+cities mostly return the same locations. Once we've learned which locations
+each city returns, a (greedy) set cover of those cities finds every known
+location with a fraction of the requests.
+"""
+
+import json
+import logging
+import os
+import time
+import typing as T
+
+from txdps.spatial import location_index
+
+
+def greedy_set_cover(
+    sets: T.Dict[str, T.Iterable[int]], covered: T.Iterable[int] = ()
+) -> T.List[str]:
+    """Pick keys whose sets together cover the union of all sets.
+
+    Repeatedly takes the key covering the most still uncovered elements, which
+    is within a log factor of the optimal cover.
+
+    Usage:
+    >>> greedy_set_cover({"a": [1, 2, 3], "b": [3, 4], "c": [4], "d": [1]})
+    ['a', 'b']
+    >>> greedy_set_cover({"a": [1, 2, 3], "b": [3, 4], "c": [4]}, covered=[1, 2])
+    ['b']
+
+    :param sets: elements covered by each key
+    :param covered: elements that are already covered and can be ignored
+    """
+    remaining = {k: set(v) for k, v in sets.items()}
+    uncovered = set().union(*remaining.values()) - set(covered)
+    cover = []
+
+    while uncovered:
+        # sort for a deterministic tie break
+        best = max(sorted(remaining), key=lambda k: len(remaining[k] & uncovered))
+        cover.append(best)
+        uncovered -= remaining.pop(best)
+
+    return cover
+
+
+class CoveragePlanner:
+    """Learn which locations each city returns and plan covering scans.
+
+    Every city is still queried at least once every `full_sweep_hours`, so new
+    DPS locations (and changes in which locations a city returns) are found.
+    """
+
+    VERSION = 2
+
+    def __init__(self, path: str = None, full_sweep_hours: float = 24):
+        """Create a planner, loading any mapping previously saved at `path`.
+
+        :param path: JSON file to persist the city -> location mapping to;
+            if not given the mapping is only kept in memory
+        :param full_sweep_hours: how often to query every city regardless
+        """
+        self.path = path
+        self.full_sweep_hours = full_sweep_hours
+        self.city_locations: T.Dict[str, T.List[int]] = {}
+        self.location_coords: T.Dict[int, T.Tuple[float, float]] = {}
+        self.last_checked: T.Dict[str, float] = {}
+
+        if path and os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            if data.get("version") == self.VERSION:
+                self.city_locations = data["cities"]
+                self.location_coords = {
+                    int(i): tuple(latlong) for i, latlong in data["locations"].items()
+                }
+                self.last_checked = data["last_checked"]
+
+    def is_stale(self, city: str, now: float = None) -> bool:
+        """Whether the city hasn't been queried in the last `full_sweep_hours`."""
+        now = now or time.time()
+        age_hours = (now - self.last_checked.get(city, 0)) / 3600
+        return city not in self.city_locations or age_hours >= self.full_sweep_hours
+
+    def plan(self, cities: T.List[str]) -> T.List[str]:
+        """Get the cities to actually query in order to cover `cities`."""
+        now = time.time()
+        # cities we haven't mapped (recently) have to be queried to learn
+        # what they cover
+        stale = [c for c in cities if self.is_stale(c, now)]
+        stale_set = set(stale)
+        covered = {i for c in stale for i in self.city_locations.get(c, [])}
+        fresh = {c: self.city_locations[c] for c in cities if c not in stale_set}
+        planned = stale + greedy_set_cover(fresh, covered=covered)
+        logging.info(
+            f"Covering {len(cities)} cities with {len(planned)} queries "
+            f"({len(stale)} due for a re-check)."
+        )
+        return planned
+
+    def prune(
+        self, cities: T.List[str], origin: T.Tuple[float, float], max_dist: float
+    ) -> T.List[str]:
+        """Drop cities whose known locations are all further than `max_dist` miles.
+
+        Cities we don't know enough about yet are always kept.
+        """
+        near = set(
+            location_index(
+                self.location_coords.keys(), self.location_coords.values()
+            ).within(origin, max_dist).index
+        )
+
+        def may_be_near(city: str) -> bool:
+            location_ids = self.city_locations.get(city)
+            if not location_ids or any(
+                i not in self.location_coords for i in location_ids
+            ):
+                return True
+            return any(i in near for i in location_ids)
+
+        pruned = [c for c in cities if may_be_near(c)]
+        logging.info(
+            f"Kept {len(pruned)} of {len(cities)} cities with locations "
+            f"possibly within {max_dist} miles."
+        )
+        return pruned
+
+    def learn(
+        self,
+        city_locations: T.Dict[str, T.Iterable[int]],
+        location_coords: T.Dict[int, T.Tuple[float, float]] = None,
+    ):
+        """Record which locations were returned for each city queried."""
+        now = time.time()
+        for city, location_ids in city_locations.items():
+            self.city_locations[city] = sorted(int(i) for i in location_ids)
+            self.last_checked[city] = now
+        for location_id, latlong in (location_coords or {}).items():
+            self.location_coords[int(location_id)] = tuple(map(float, latlong))
+        self.save()
+
+    def save(self):
+        """Persist the learned mapping, if a path was given."""
+        if not self.path:
+            return
+
+        data = {
+            "version": self.VERSION,
+            "last_checked": self.last_checked,
+            "cities": self.city_locations,
+            "locations": self.location_coords,
+        }
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
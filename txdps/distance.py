@@ -1,21 +1,52 @@
 """Utility functions chunky enough to be separated from main layout module."""
+import functools
 import math
+import os
 import typing as T
 
+import numpy as np
 import pandas as pd
 from uszipcode import SearchEngine
 
+from txdps.distmatrix import load_distance_matrix, write_distance_matrix
+from txdps.zipcodes import load_zip_table
 
+# shipped in the package (see `txdps build_zip_table`); zips are looked up with
+# uszipcode, which downloads its DB on first use, if it's missing
+ZIP_TABLE_PATH = os.getenv(
+    "TXDPS_ZIP_TABLE", os.path.join(os.path.dirname(__file__), "data", "zips.npy")
+)
+ZIP_TABLE = load_zip_table(ZIP_TABLE_PATH)
+
+# precomputed distances from Texas zip codes to locations, rebuilt on each pull
+# if set; see `build_distance_matrix`
+DISTANCE_MATRIX_PATH = os.getenv("TXDPS_DISTANCE_MATRIX")
+
+# first 3 digits of Texas zip codes
+TEXAS_ZIP_PREFIXES = [733, *range(750, 800), 885]
+
+
+@functools.lru_cache(maxsize=None)
+def _search_engine() -> SearchEngine:
+    return SearchEngine(simple_zipcode=True)
+
+
+@functools.lru_cache(maxsize=1024)
 def is_valid_zip(zip_code: int):
     """See if the given value is a valid US zip code."""
-    search = SearchEngine(simple_zipcode=True)
-    origin_zip = search.by_zipcode(zip_code)
+    if ZIP_TABLE is not None:
+        return ZIP_TABLE.get(zip_code)
+
+    origin_zip = _search_engine().by_zipcode(zip_code)
 
     if origin_zip.zipcode is None:
         return None
     return (origin_zip.lat, origin_zip.lng)
 
 
+RADII = {"km": 6371, "mi": 3959, "ft": 3959 * 5280, "m": 6371 * 1000}
+
+
 def haversine_distance(
     origin: T.Tuple[float, float], destination: T.Tuple[float, float], unit="mi"
 ) -> float:
@@ -30,7 +61,7 @@ def haversine_distance(
     """
     lat1, lon1 = origin
     lat2, lon2 = destination
-    radius = {"km": 6371, "mi": 3959, "ft": 3959 * 5280, "m": 6371 * 1000}.get(unit)
+    radius = RADII[unit]
 
     dlat = math.radians(lat2 - lat1)
     dlon = math.radians(lon2 - lon1)
@@ -43,6 +74,95 @@ def haversine_distance(
     return d
 
 
+def haversine_matrix(
+    origins: T.Sequence[T.Tuple[float, float]],
+    destinations: T.Sequence[T.Tuple[float, float]],
+    unit="mi",
+) -> np.ndarray:
+    """Get the Haversine distance from every origin to every destination at once.
+
+    Same as `haversine_distance` for each pair, but vectorized with numpy.
+
+    Usage:
+    >>> austin, houston, dallas = (30.27, -97.74), (29.76, -95.37), (32.78, -96.8)
+    >>> haversine_matrix([austin, houston], [dallas, austin]).round(1)
+    array([[182.1,   0. ],
+           [225.1, 146.1]])
+
+    :param origins: lat longs, or an (n, 2) array of them
+    :param destinations: lat longs, or an (m, 2) array of them
+    :param unit: as for `haversine_distance`
+    :return: (n, m) array of distances
+    """
+    origins = np.radians(np.asarray(origins, dtype=float).reshape(-1, 2))
+    destinations = np.radians(np.asarray(destinations, dtype=float).reshape(-1, 2))
+    lat1, lon1 = origins[:, :1], origins[:, 1:]
+    lat2, lon2 = destinations[:, 0], destinations[:, 1]
+
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return RADII[unit] * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def texas_zips() -> T.Tuple[np.ndarray, np.ndarray]:
+    """Get every Texas zip code and its centroid.
+
+    :return: zip codes, and an (n, 2) array of their lat longs
+    """
+    if ZIP_TABLE is not None:
+        zips = np.concatenate(
+            [np.arange(p * 100, (p + 1) * 100) for p in TEXAS_ZIP_PREFIXES]
+        )
+        latlongs = ZIP_TABLE.latlongs(zips)
+        known = ~np.isnan(latlongs[:, 0])
+        return zips[known], latlongs[known]
+
+    rows = [
+        (int(z.zipcode), z.lat, z.lng)
+        for z in _search_engine().by_state("TX", returns=0)
+        if z.lat is not None
+    ]
+    zips, lats, longs = zip(*rows)
+    return np.array(zips), np.column_stack([lats, longs])
+
+
+def build_distance_matrix(path: str, df: pd.DataFrame) -> bool:
+    """Precompute distances from every Texas zip code to the locations in `df`.
+
+    Skipped if the matrix at `path` already covers the same locations.
+
+    :param df: locations indexed by Id
+    :return: whether the matrix was (re)built
+    """
+    order = np.argsort(df.index.to_numpy())
+    location_ids = df.index.to_numpy()[order].astype("int64")
+    latlongs = df[["Latitude", "Longitude"]].to_numpy(dtype=float)[order]
+    matrix = load_distance_matrix(path)
+    if matrix is not None and matrix.covers(location_ids, latlongs):
+        return False
+
+    zips, zip_latlongs = texas_zips()
+    write_distance_matrix(
+        path, zips, location_ids, latlongs, haversine_matrix(zip_latlongs, latlongs)
+    )
+    return True
+
+
+def zip_distances(
+    zip_code: int, location_ids: T.Sequence[int]
+) -> T.Optional[np.ndarray]:
+    """Look up precomputed distances from a zip code to the given locations.
+
+    None if there's no precomputed matrix covering them.
+    """
+    matrix = load_distance_matrix(DISTANCE_MATRIX_PATH)
+    if matrix is None:
+        return None
+    return matrix.get(zip_code, location_ids)
+
+
 def update_distances(df: pd.DataFrame, zip_code: int):
     """Update distance column based on provided ZIP code."""
     origin_latlong = is_valid_zip(zip_code)
@@ -50,12 +170,11 @@ def update_distances(df: pd.DataFrame, zip_code: int):
         df["Distance"] = None
         return df
 
-    df["Distance"] = df[["Latitude", "Longitude"]].apply(
-        lambda row: round(
-            haversine_distance(origin_latlong, (row["Latitude"], row["Longitude"])),
-            2,
-        ),
-        axis=1,
-    )
+    distances = zip_distances(zip_code, df["SiteId" if "SiteId" in df else "Id"])
+    if distances is None:
+        distances = haversine_matrix(
+            [origin_latlong], df[["Latitude", "Longitude"]].to_numpy()
+        )[0]
+    df["Distance"] = np.asarray(distances, dtype=float).round(2)
 
     return df
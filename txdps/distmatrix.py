@@ -0,0 +1,173 @@
+"""Precomputed zip code -> DPS location distances, shared through a memory map.
+
+The distances from every zip code centroid of interest to every location are
+saved as a (zips, locations) float32 .npy file, alongside a small .npz index
+of which zip code each row and which location each column is. Both are
+stamped with the same build id (the matrix's after its data), so a matrix
+read alongside an index from another build is never used. Loading the
+matrix memory maps it, so every process on a host shares the one copy in the
+page cache, and the distances from a zip code are one row of it.
+"""
+import logging
+import os
+import typing as T
+import uuid
+
+import numpy as np
+
+# length of the (hex) build id stamped on a matrix and its index
+BUILD_ID_SIZE = 32
+
+
+def index_path(path: str) -> str:
+    """Get where the row and column index of the matrix at `path` is kept."""
+    return f"{path}.index.npz"
+
+
+def _read_matrix(path: str) -> T.Tuple[np.memmap, str]:
+    """Memory map the matrix at `path` and read the build id after its data.
+
+    Both come from the one open file, so they match even if the file is
+    replaced in between.
+    """
+    with open(path, "rb") as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+        distances = np.memmap(
+            f,
+            dtype=dtype,
+            mode="r",
+            offset=offset,
+            shape=shape,
+            order="F" if fortran_order else "C",
+        )
+        build_id = ""
+        if os.fstat(f.fileno()).st_size == offset + distances.nbytes + BUILD_ID_SIZE:
+            f.seek(offset + distances.nbytes)
+            build_id = f.read(BUILD_ID_SIZE).decode("ascii", "replace")
+    return distances, build_id
+
+
+class DistanceMatrix:
+    """Look up precomputed distances from zip codes to locations."""
+
+    def __init__(self, path: str):
+        """Memory map the matrix at `path` and load its index."""
+        self.path = path
+        with np.load(index_path(path)) as index:
+            self.zips = index["zips"]
+            self.location_ids = index["location_ids"]
+            self.latlongs = index["latlongs"]
+            self.build_id = index["build_id"].item()
+        self.distances, build_id = _read_matrix(path)
+        if build_id != self.build_id or self.distances.shape != (
+            len(self.zips),
+            len(self.location_ids),
+        ):
+            raise ValueError(f"Distance matrix doesn't match its index: {path}")
+
+    def covers(
+        self,
+        location_ids: T.Sequence[int],
+        latlongs: T.Sequence[T.Tuple[float, float]],
+    ) -> bool:
+        """Whether the matrix was built for exactly these locations."""
+        return np.array_equal(self.location_ids, location_ids) and np.allclose(
+            self.latlongs, np.asarray(latlongs, dtype=float).reshape(-1, 2)
+        )
+
+    def get(
+        self, zip_code: int, location_ids: T.Sequence[int]
+    ) -> T.Optional[np.ndarray]:
+        """Get distances from a zip code to the given locations, in miles.
+
+        None if the zip code or any of the locations aren't in the matrix.
+        """
+        try:
+            zip_code = int(zip_code)
+        except (TypeError, ValueError):
+            return None
+        row = np.searchsorted(self.zips, zip_code)
+        if row == len(self.zips) or self.zips[row] != zip_code:
+            return None
+
+        if not len(self.location_ids):
+            return None
+        location_ids = np.asarray(location_ids)
+        cols = np.searchsorted(self.location_ids, location_ids)
+        cols = np.minimum(cols, len(self.location_ids) - 1)
+        if (self.location_ids[cols] != location_ids).any():
+            return None
+        return self.distances[row, cols]
+
+
+def write_distance_matrix(
+    path: str,
+    zips: np.ndarray,
+    location_ids: np.ndarray,
+    latlongs: np.ndarray,
+    distances: np.ndarray,
+) -> DistanceMatrix:
+    """Save a matrix of distances from zip codes (rows) to locations (columns).
+
+    Rows and columns are sorted by zip code and location id, so they can be
+    found by bisection.
+    """
+    build_id = uuid.uuid4().hex
+    zip_order = np.argsort(zips)
+    location_order = np.argsort(location_ids)
+    distances = np.asarray(distances, dtype=np.float32)[zip_order][:, location_order]
+
+    # the index goes first: readers treat a matrix that doesn't match its
+    # index as missing until both are replaced
+    tmp_index = f"{path}.tmp.npz"
+    np.savez(
+        tmp_index,
+        zips=np.asarray(zips, dtype="int64")[zip_order],
+        location_ids=np.asarray(location_ids, dtype="int64")[location_order],
+        latlongs=np.asarray(latlongs, dtype=float)[location_order],
+        build_id=np.array(build_id),
+    )
+    os.replace(tmp_index, index_path(path))
+    tmp_path = f"{path}.tmp.npy"
+    with open(tmp_path, "wb") as f:
+        np.save(f, distances)
+        f.write(build_id.encode("ascii"))
+    os.replace(tmp_path, path)
+
+    logging.info(
+        f"Wrote distances from {len(zips)} zip codes to "
+        f"{len(location_ids)} locations to {path}"
+    )
+    return DistanceMatrix(path)
+
+
+# path -> (mtime, matrix) of matrices loaded
+_LOADED: T.Dict[str, T.Tuple[float, T.Optional[DistanceMatrix]]] = {}
+
+
+def load_distance_matrix(path: str) -> T.Optional[DistanceMatrix]:
+    """Load the matrix at `path`, reusing it until the file changes.
+
+    None if it hasn't been built (or is only partly written).
+    """
+    if not path:
+        return None
+    try:
+        mtime = os.stat(path).st_mtime
+    except FileNotFoundError:
+        return None
+
+    cached = _LOADED.get(path)
+    if cached is None or cached[0] != mtime:
+        try:
+            matrix = DistanceMatrix(path)
+        except (OSError, KeyError, ValueError) as exc:
+            logging.warning(f"Not using distance matrix {path}: {exc}")
+            matrix = None
+        _LOADED[path] = (mtime, matrix)
+    return _LOADED[path][1]
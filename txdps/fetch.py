@@ -0,0 +1,131 @@
+"""Rate limited, retrying scheduler for concurrent DPS API requests."""
+import asyncio
+import logging
+import random
+import time
+import typing as T
+
+import aiohttp
+
+
+class RetryableError(Exception):
+    """An API error that may succeed if retried, e.g. a 5xx or 429 response."""
+
+
+# errors that are worth another try: network hiccups, timeouts, and anything
+# the API itself flags as transient
+RETRYABLE_ERRORS = (RetryableError, aiohttp.ClientError, asyncio.TimeoutError)
+
+
+class FetchResult(T.NamedTuple):
+    """Outcome of a single scheduled request; exactly one of value/error is set."""
+
+    key: T.Any
+    value: T.Any = None
+    error: Exception = None
+
+    @property
+    def ok(self) -> bool:
+        """Whether the request succeeded."""
+        return self.error is None
+
+
+class TokenBucket:
+    """Token bucket limiting how many requests start per second."""
+
+    def __init__(self, rate: float, capacity: int = None):
+        """Allow `rate` requests per second, with bursts of up to `capacity`."""
+        self.rate = rate
+        self.capacity = capacity or max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._last = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def try_acquire(self) -> bool:
+        """Take a token if one is available right now."""
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    async def acquire(self):
+        """Wait until a token is available, then take it."""
+        while not self.try_acquire():
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class FetchScheduler:
+    """Run many API requests concurrently within rate and concurrency limits.
+
+    Each request is retried with jittered exponential backoff on transient
+    errors. Failures are returned per request as a FetchResult instead of
+    being raised, so one bad request doesn't throw away the rest of a batch.
+    """
+
+    def __init__(
+        self,
+        rate: float = 20,
+        max_in_flight: int = 10,
+        retries: int = 3,
+        backoff: float = 0.5,
+        max_backoff: float = 10,
+    ):
+        """Configure the scheduler.
+
+        :param rate: max requests started per second
+        :param max_in_flight: max requests awaiting a response at once
+        :param retries: how many times to retry a request on transient errors
+        :param backoff: base delay in seconds between retries; doubles each try
+        :param max_backoff: upper bound on the delay between retries
+        """
+        self.rate = rate
+        self.max_in_flight = max_in_flight
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._bucket = TokenBucket(rate)
+        self._semaphore = None
+        self._loop = None
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # semaphores are bound to an event loop, so make a new one per loop
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+            self._loop = loop
+        return self._semaphore
+
+    async def fetch(
+        self, key: T.Any, fn: T.Callable[..., T.Awaitable], *args, **kwargs
+    ) -> FetchResult:
+        """Call `fn(*args, **kwargs)` under the scheduler's limits."""
+        semaphore = self._get_semaphore()
+        error = None
+
+        for attempt in range(self.retries + 1):
+            async with semaphore:
+                await self._bucket.acquire()
+                try:
+                    return FetchResult(key, value=await fn(*args, **kwargs))
+                except RETRYABLE_ERRORS as exc:
+                    error = exc
+                except Exception as exc:
+                    return FetchResult(key, error=exc)
+
+            if attempt < self.retries:
+                # "full jitter" backoff keeps retries from arriving in lockstep
+                delay = random.uniform(
+                    0, min(self.max_backoff, self.backoff * 2 ** attempt)
+                )
+                logging.warning(
+                    f"Request for '{key}' failed ({error!r}); "
+                    f"retrying in {delay:.2f}s..."
+                )
+                await asyncio.sleep(delay)
+
+        return FetchResult(key, error=error)
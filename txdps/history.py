@@ -0,0 +1,161 @@
+"""Append-only store of how each location's next available date changes over time.
+
+Each refresh's snapshot is appended as Parquet files under a directory per
+day (`<root>/date=YYYY-MM-DD/`). Within a day only rows whose next available
+date changed since the last refresh are written (run-length encoding), except
+for the day's first refresh, which writes every location so that each day's
+partition can be read on its own: the value of a location at any time on a
+day is its last row in that day's partition at or before that time.
+"""
+import logging
+import os
+import time
+import typing as T
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+COLUMNS = ["Id", "Name", "ObservedAt", "NextAvailableDate"]
+
+
+class HistoryStore:
+    """Day-partitioned, run-length deduplicated availability history."""
+
+    def __init__(self, root: str):
+        """Use (or start) a history store in the directory `root`."""
+        self.root = root
+
+    def _partition(self, day: date) -> str:
+        return os.path.join(self.root, f"date={day.isoformat()}")
+
+    def _read_partition(self, day: date) -> pd.DataFrame:
+        path = self._partition(day)
+        if not os.path.isdir(path):
+            return pd.DataFrame(columns=COLUMNS)
+        files = sorted(f for f in os.listdir(path) if f.endswith(".parquet"))
+        if not files:
+            return pd.DataFrame(columns=COLUMNS)
+        return pd.concat(
+            [pq.read_table(os.path.join(path, f)).to_pandas() for f in files],
+            ignore_index=True,
+        )
+
+    def append(self, df: pd.DataFrame, observed_at: datetime = None) -> int:
+        """Record a snapshot of locations indexed by Id, returning rows written."""
+        observed_at = observed_at or datetime.now()
+        rows = pd.DataFrame(
+            {
+                "Id": df.index.astype("int64"),
+                "Name": df["Name"].astype(str).values,
+                "ObservedAt": pd.Timestamp(observed_at),
+                "NextAvailableDate": pd.to_datetime(df["NextAvailableDate"]).values,
+            }
+        )
+
+        latest = self._read_partition(observed_at.date())
+        if len(latest):
+            # not .last(), which skips missing dates
+            last = latest.groupby("Id").tail(1).set_index("Id")["NextAvailableDate"]
+            prev = rows["Id"].map(last)
+            new = rows["NextAvailableDate"]
+            # NaT != NaT, so compare missing dates separately
+            unchanged = rows["Id"].isin(last.index) & (
+                (prev == new) | (prev.isna() & new.isna())
+            )
+            rows = rows[~unchanged]
+
+        if not len(rows):
+            return 0
+
+        path = self._partition(observed_at.date())
+        os.makedirs(path, exist_ok=True)
+        name = f"part-{observed_at.strftime('%H%M%S')}-{time.time_ns()}.parquet"
+        pq.write_table(
+            pa.Table.from_pandas(rows[COLUMNS], preserve_index=False),
+            os.path.join(path, name),
+            compression="zstd",
+        )
+        logging.info(f"Recorded {len(rows)} availability changes in {path}")
+        return len(rows)
+
+    def days(self) -> T.List[date]:
+        """Get every day with history recorded."""
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            date.fromisoformat(d.split("=", 1)[1])
+            for d in os.listdir(self.root)
+            if d.startswith("date=")
+        )
+
+    def series(
+        self,
+        start: datetime = None,
+        end: datetime = None,
+        location_ids: T.Iterable[int] = None,
+    ) -> pd.DataFrame:
+        """Get the changes observed between `start` and `end`, oldest first.
+
+        Only the partitions for days in that range are read. Each location's
+        first row is its value as of `start` (or the start of the day).
+        """
+        start_day = start.date() if start else date.min
+        end_day = end.date() if end else date.max
+        days = [d for d in self.days() if start_day <= d <= end_day]
+        if not days:
+            return pd.DataFrame(columns=COLUMNS)
+
+        df = pd.concat([self._read_partition(d) for d in days], ignore_index=True)
+        if location_ids is not None:
+            df = df[df["Id"].isin(list(location_ids))]
+        if end is not None:
+            df = df[df["ObservedAt"] <= end]
+        if start is not None:
+            # keep the value in effect at start, from the day's first rows
+            before = df[df["ObservedAt"] <= start]
+            as_of = before.groupby("Id").tail(1).assign(ObservedAt=pd.Timestamp(start))
+            df = pd.concat([as_of, df[df["ObservedAt"] > start]])
+
+        df = df.sort_values(["ObservedAt", "Id"], kind="stable")
+        return df.reset_index(drop=True)[COLUMNS]
+
+    def summarize(self, *args, **kwargs) -> pd.DataFrame:
+        """Summarize, per location, how its availability changed over a range.
+
+        Takes the same arguments as `series`. Columns are how many times the
+        next available date moved earlier (i.e. an opening appeared) or later,
+        how many earlier moves there were per day of the range, and the mean number
+        of days out the next available date was when each change was observed.
+        """
+        df = self.series(*args, **kwargs)
+        if not len(df):
+            return pd.DataFrame(
+                columns=["Name", "Earlier", "Later", "EarlierPerDay", "MeanLeadDays"]
+            )
+
+        df = df.copy()
+        delta = df.groupby("Id")["NextAvailableDate"].diff()
+        df["Earlier"] = delta < timedelta(0)
+        df["Later"] = delta > timedelta(0)
+        df["LeadDays"] = (df["NextAvailableDate"] - df["ObservedAt"]).dt.days
+
+        grouped = df.groupby("Id")
+        days_observed = (
+            df["ObservedAt"].max() - df["ObservedAt"].min()
+        ).total_seconds() / 86400
+        summary = pd.DataFrame(
+            {
+                "Name": grouped["Name"].last(),
+                "Earlier": grouped["Earlier"].sum(),
+                "Later": grouped["Later"].sum(),
+                "MeanLeadDays": grouped["LeadDays"].mean().round(1),
+            }
+        )
+        summary["EarlierPerDay"] = (
+            (summary["Earlier"] / days_observed).round(2) if days_observed else None
+        )
+        return summary[
+            ["Name", "Earlier", "Later", "EarlierPerDay", "MeanLeadDays"]
+        ].sort_values("Earlier", ascending=False)
@@ -20,8 +20,10 @@ import pandas as pd
 import plotly.express as px
 from dash.dependencies import Input, Output, State
 
-from txdps.distance import is_valid_zip, update_distances
+from txdps.distance import is_valid_zip, zip_distances
 from txdps.search import filter_df
+from txdps.snapshot import read_manifest, read_snapshot, snapshot_hash
+from txdps.spatial import location_index
 
 px.set_mapbox_access_token(os.getenv("MAPBOX_TOKEN"))
 
@@ -34,6 +36,13 @@ def get_slider_marks():
 
 
 def get_data_last_updated():
+    manifest = read_manifest(S3_URI)
+    if manifest is not None:
+        return datetime.fromisoformat(manifest["updated_at"])
+    return _file_last_updated()
+
+
+def _file_last_updated():
     parts = urlparse(S3_URI)
     if parts.scheme in ("", "file"):
         return datetime.fromtimestamp(os.stat(parts.path).st_mtime)
@@ -47,8 +56,33 @@ def get_data_last_updated():
         raise ValueError(f"Unrecognized uri: {S3_URI}")
 
 
+# (key it was loaded under, snapshot hash, frame) of the last snapshot loaded
+_CACHED_DF: T.Tuple[T.Optional[str], T.Optional[str], T.Optional[pd.DataFrame]]
+_CACHED_DF = (None, None, None)
+
+
 def load_original_df():
-    df = pd.read_csv(S3_URI).rename({"Id": "SiteId", "Name": "SiteName"}, axis=1)
+    """Load the latest snapshot, reusing the last one loaded if it's unchanged."""
+    global _CACHED_DF
+    manifest = read_manifest(S3_URI)
+    digest = manifest and manifest.get("hash")
+    # without a manifest, go by when the snapshot was last modified
+    key = digest or f"modified:{_file_last_updated()}"
+    if key != _CACHED_DF[0]:
+        df = _load_snapshot_df()
+        # hashed once per load, to identify the snapshot in search caches
+        _CACHED_DF = (key, digest or snapshot_hash(df), df)
+    # callers add columns to what they're given
+    return _CACHED_DF[2].copy()
+
+
+def get_snapshot_hash() -> T.Optional[str]:
+    """Get the hash of the snapshot last loaded by `load_original_df`."""
+    return _CACHED_DF[1]
+
+
+def _load_snapshot_df():
+    df = read_snapshot(S3_URI).rename({"Id": "SiteId", "Name": "SiteName"}, axis=1)
     df["NextAvailableDate"] = pd.to_datetime(df["NextAvailableDate"]).dt.date
     df["Distance"] = None
     df["IsSelected"] = False
@@ -70,15 +104,32 @@ def load_original_df():
 
 def update_df(query: str, zip_code: int, distance_range: T.List[int]):
     df = load_original_df()
-    # apply filters on Algolia index first
-    df = filter_df(df, query)
-    df = update_distances(df, zip_code)
-
-    if is_valid_zip(zip_code):
-        df = df[
-            (df["Distance"] >= distance_range[0])
-            & (df["Distance"] <= distance_range[1])
+    distances = None
+
+    origin = is_valid_zip(zip_code)
+    if origin is not None:
+        distances = zip_distances(zip_code, df["SiteId"])
+        if distances is not None:
+            distances = pd.Series(
+                np.asarray(distances, dtype=float).round(2), index=df["SiteId"]
+            )
+        else:
+            # index every location, so it's only rebuilt when the snapshot's
+            # locations change, then only measure the distance to nearby ones
+            index = location_index(
+                df["SiteId"], df[["Latitude", "Longitude"]].to_numpy()
+            )
+            distances = index.within(origin, distance_range[1]).round(2)
+        distances = distances[
+            (distances >= distance_range[0]) & (distances <= distance_range[1])
         ]
+
+    # search every location in the snapshot, so that a local search index is
+    # only rebuilt when the snapshot changes
+    df = filter_df(df, query, version=get_snapshot_hash())
+    if distances is not None:
+        df = df[df["SiteId"].isin(distances.index)].copy()
+        df["Distance"] = df["SiteId"].map(distances)
     return df
 
 
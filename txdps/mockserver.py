@@ -0,0 +1,281 @@
+"""Local stand-in for the DPS scheduler API, for load testing and benchmarks.
+
+Serves synthetic cities, locations, and slots from the same endpoints as the
+real API, with optional latency, error, and throttling injection. Point the
+CLI at it by setting TXDPS_API_URL, e.g. to http://localhost:8100/api.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import math
+import random
+import typing as T
+from collections import Counter
+from datetime import datetime, timedelta
+
+from aiohttp import web
+
+from txdps.fetch import TokenBucket
+
+# rough bounding box of Texas
+LAT_RANGE = (25.9, 36.5)
+LONG_RANGE = (-106.6, -93.5)
+LOCATIONS_PER_CITY = 5
+SLOT_MINUTES = 20
+
+
+def _json(body: T.Any, status: int = 200) -> web.Response:
+    # the real API labels its JSON as text/plain
+    return web.Response(text=json.dumps(body), status=status, content_type="text/plain")
+
+
+class MockScheduler:
+    """Synthetic DPS scheduler data and the handlers serving it."""
+
+    def __init__(
+        self,
+        n_cities: int = 250,
+        n_locations: int = 100,
+        days: int = 60,
+        slots_per_day: int = 8,
+        seed: int = 0,
+    ):
+        """Generate synthetic data.
+
+        :param n_cities: number of cities listed in SiteData
+        :param n_locations: number of DPS locations
+        :param days: how many days out slots are offered
+        :param slots_per_day: max open slots per location per day
+        :param seed: random seed, for reproducible data
+        """
+        rng = random.Random(seed)
+        self._slot_ids = itertools.count(1)
+        self._conf_nums = itertools.count(100000)
+        self.bookings: T.Dict[int, dict] = {}
+        today = datetime.combine(datetime.now().date(), datetime.min.time())
+
+        def random_point():
+            return rng.uniform(*LAT_RANGE), rng.uniform(*LONG_RANGE)
+
+        self.locations = {}
+        self.slots: T.Dict[int, T.Dict[int, dict]] = {}
+        for location_id in range(1, n_locations + 1):
+            lat, long = random_point()
+            town = f"Town {location_id}"
+            self.locations[location_id] = {
+                "Id": location_id,
+                "Name": f"{town} DPS",
+                "Address": f"{rng.randint(100, 9999)} Main St, {town}, "
+                f"{rng.randint(75000, 79999)}",
+                "MapUrl": f"http://maps.google.com/?saddr=&daddr={lat},{long}",
+                "Latitude": lat,
+                "Longitude": long,
+            }
+            self.slots[location_id] = {}
+            for day in range(1, days + 1):
+                start = today + timedelta(days=day, hours=8)
+                n_slots = rng.randint(0, slots_per_day)
+                for n in sorted(rng.sample(range(24), n_slots)):
+                    slot_start = start + timedelta(minutes=SLOT_MINUTES * n)
+                    slot_id = next(self._slot_ids)
+                    self.slots[location_id][slot_id] = {
+                        "SlotId": slot_id,
+                        "Duration": SLOT_MINUTES,
+                        "StartDateTime": slot_start.isoformat(),
+                        "EndDateTime": (
+                            slot_start + timedelta(minutes=SLOT_MINUTES)
+                        ).isoformat(),
+                    }
+
+        self.cities = {}
+        for n in range(n_cities):
+            lat, long = random_point()
+            nearest = sorted(
+                self.locations.values(),
+                key=lambda loc: math.hypot(
+                    loc["Latitude"] - lat, loc["Longitude"] - long
+                ),
+            )[:LOCATIONS_PER_CITY]
+            self.cities[f"City {n}"] = [loc["Id"] for loc in nearest]
+
+    def _open_slots(self, location_id: int) -> T.List[dict]:
+        return sorted(
+            self.slots.get(location_id, {}).values(), key=lambda s: s["StartDateTime"]
+        )
+
+    def _find_slot(self, slot_id: int) -> T.Optional[T.Tuple[int, dict]]:
+        for location_id, slots in self.slots.items():
+            if slot_id in slots:
+                return location_id, slots[slot_id]
+        return None
+
+    async def site_data(self, request: web.Request) -> web.Response:
+        """Handle SiteData."""
+        return _json({"Cities": [{"Name": c} for c in self.cities]})
+
+    async def available_location(self, request: web.Request) -> web.Response:
+        """Handle AvailableLocation: the locations nearest a city."""
+        body = await request.json()
+        location_ids = self.cities.get(body.get("CityName"))
+        if location_ids is None:
+            return _json({"Message": "Unknown city"}, status=400)
+
+        records = []
+        for location_id in location_ids:
+            loc = self.locations[location_id]
+            slots = self._open_slots(location_id)
+            next_date = (
+                datetime.fromisoformat(slots[0]["StartDateTime"]).strftime("%m/%d/%Y")
+                if slots
+                else None
+            )
+            records.append(
+                {
+                    "Id": loc["Id"],
+                    "Name": loc["Name"],
+                    "Address": loc["Address"],
+                    "MapUrl": loc["MapUrl"],
+                    "NextAvailableDate": next_date,
+                }
+            )
+        return _json(records)
+
+    async def available_location_dates(self, request: web.Request) -> web.Response:
+        """Handle AvailableLocationDates: open slots at a location, by day."""
+        body = await request.json()
+        by_day = {}
+        for slot in self._open_slots(body.get("LocationId")):
+            by_day.setdefault(slot["StartDateTime"][:10], []).append(slot)
+        return _json(
+            {
+                "LocationAvailabilityDates": [
+                    {"AvailabilityDate": day, "AvailableTimeSlots": slots}
+                    for day, slots in by_day.items()
+                ]
+            }
+        )
+
+    async def hold_slot(self, request: web.Request) -> web.Response:
+        """Handle HoldSlot."""
+        body = await request.json()
+        return _json(
+            {"SlotHeldSuccessfuly": self._find_slot(body["SlotId"]) is not None}
+        )
+
+    def _bookings_for(self, body: dict) -> T.List[dict]:
+        person = (body.get("FirstName"), body.get("LastName"), body.get("DateOfBirth"))
+        return [b for b in self.bookings.values() if b["_person"] == person]
+
+    async def booking(self, request: web.Request) -> web.Response:
+        """Handle Booking: list a person's existing bookings."""
+        body = await request.json()
+        return _json(
+            [
+                {k: v for k, v in b.items() if not k.startswith("_")}
+                for b in self._bookings_for(body)
+            ]
+        )
+
+    async def new_booking(self, request: web.Request) -> web.Response:
+        """Handle NewBooking and RescheduleBooking."""
+        body = await request.json()
+        slot = next(
+            (
+                s
+                for s in self.slots.get(body.get("SiteId"), {}).values()
+                if s["StartDateTime"] == body.get("BookingDateTime")
+            ),
+            None,
+        )
+        if slot is None:
+            return _json({"ErrorMessage": "This slot is no longer available."})
+
+        # booking again replaces any existing booking (not freeing up its slot)
+        for old in self._bookings_for(body):
+            del self.bookings[old["ConfirmationNumber"]]
+
+        del self.slots[body["SiteId"]][slot["SlotId"]]
+        conf_num = next(self._conf_nums)
+        self.bookings[conf_num] = {
+            "ConfirmationNumber": conf_num,
+            "ServiceTypeId": body.get("ServiceTypeId"),
+            "BookingDateTime": slot["StartDateTime"],
+            "SiteId": body["SiteId"],
+            "SiteName": self.locations[body["SiteId"]]["Name"],
+            "_person": (
+                body.get("FirstName"),
+                body.get("LastName"),
+                body.get("DateOfBirth"),
+            ),
+        }
+        return _json({"Booking": {"ConfirmationNumber": conf_num}})
+
+    async def cancel_booking(self, request: web.Request) -> web.Response:
+        """Handle CancelBooking."""
+        body = await request.json()
+        booking = self.bookings.pop(body.get("ConfirmationNumber"), None)
+        if booking is None:
+            return _json({"ErrorMessage": "Booking not found."}, status=400)
+        return _json({"ConfirmationNumber": booking["ConfirmationNumber"]})
+
+
+def create_app(
+    scheduler: MockScheduler,
+    latency: float = 0.0,
+    latency_jitter: float = 0.0,
+    error_rate: float = 0.0,
+    rate_limit: float = None,
+) -> web.Application:
+    """Create an app serving the mock API under /api, with fault injection.
+
+    :param latency: seconds to delay every response by
+    :param latency_jitter: extra random delay of up to this many seconds
+    :param error_rate: fraction of requests to fail with a 500
+    :param rate_limit: requests per second over which to respond with a 429
+    """
+    bucket = TokenBucket(rate_limit) if rate_limit else None
+    stats = Counter()
+
+    @web.middleware
+    async def inject_faults(request: web.Request, handler):
+        if not request.path.startswith("/api/"):
+            return await handler(request)
+
+        stats[f"requests.{request.path}"] += 1
+        await asyncio.sleep(latency + random.uniform(0, latency_jitter))
+
+        if bucket is not None and not bucket.try_acquire():
+            response = _json({"Message": "Too many requests"}, status=429)
+        elif random.random() < error_rate:
+            response = _json({"Message": "An error has occurred."}, status=500)
+        else:
+            response = await handler(request)
+
+        stats[f"status.{response.status}"] += 1
+        return response
+
+    async def get_stats(request: web.Request) -> web.Response:
+        return web.json_response(dict(stats))
+
+    app = web.Application(middlewares=[inject_faults])
+    app.add_routes(
+        [
+            web.get("/api/SiteData", scheduler.site_data),
+            web.post("/api/AvailableLocation", scheduler.available_location),
+            web.post("/api/AvailableLocationDates", scheduler.available_location_dates),
+            web.post("/api/HoldSlot", scheduler.hold_slot),
+            web.post("/api/Booking", scheduler.booking),
+            web.post("/api/NewBooking", scheduler.new_booking),
+            web.post("/api/RescheduleBooking", scheduler.new_booking),
+            web.post("/api/CancelBooking", scheduler.cancel_booking),
+            # request and response status counts, without fault injection
+            web.get("/__stats", get_stats),
+        ]
+    )
+
+    logging.info(
+        f"Mock DPS API with {len(scheduler.cities)} cities and "
+        f"{len(scheduler.locations)} locations."
+    )
+    return app
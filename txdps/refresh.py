@@ -0,0 +1,165 @@
+"""Incrementally refresh the location snapshot, polling volatile locations more.
+
+Rather than re-querying every city on a fixed interval, each run spends a
+fixed budget of city lookups on the cities covering the locations most likely
+to have changed since they were last seen: those whose next available date
+has been changing often (tracked as an exponentially weighted rate of changes
+per hour), weighted up near active subscribers. Results are merged into the
+previous snapshot.
+"""
+import logging
+import math
+import time
+import typing as T
+
+import numpy as np
+import pandas as pd
+
+from txdps.api import get_site_info
+from txdps.coverage import greedy_set_cover
+from txdps.distance import haversine_matrix
+from txdps.scan import PLANNER, fetch_cities
+
+
+def locations_near(
+    location_coords: T.Dict[int, T.Tuple[float, float]],
+    origin_radii: T.Dict[T.Tuple[float, float], float],
+) -> T.Set[int]:
+    """Get the locations within range of any of the origins."""
+    if not location_coords or not origin_radii:
+        return set()
+    location_ids = list(location_coords)
+    in_range = haversine_matrix(
+        list(origin_radii), [location_coords[i] for i in location_ids]
+    ) <= np.array(list(origin_radii.values()))[:, None]
+    return {location_ids[j] for j in np.flatnonzero(in_range.any(axis=0))}
+
+
+def merge_snapshot(prev: pd.DataFrame, fresh: pd.DataFrame) -> pd.DataFrame:
+    """Replace the rows of `prev` that were looked up again with `fresh` ones."""
+    merged = pd.concat([prev.drop(fresh.index, errors="ignore"), fresh])
+    return merged.sort_values("NextAvailableDate")
+
+
+class AdaptivePoller:
+    """Track how often each location's availability changes and poll accordingly.
+
+    A location's urgency is its estimated rate of change times the hours since
+    it was last polled, so even stable locations are eventually polled again.
+    Locations never polled are always the most urgent.
+    """
+
+    def __init__(
+        self,
+        alpha: float = 0.3,
+        prior_rate: float = 1.0,
+        hot_weight: float = 4.0,
+        full_sweep_hours: float = 24,
+    ):
+        """Configure the poller.
+
+        :param alpha: weight of the latest observation in each change rate
+        :param prior_rate: changes per hour assumed for a location polled once
+        :param hot_weight: how much more urgent locations near subscribers are
+        :param full_sweep_hours: how often to rebuild the snapshot from scratch,
+            to pick up new DPS locations
+        """
+        self.alpha = alpha
+        self.prior_rate = prior_rate
+        self.hot_weight = hot_weight
+        self.full_sweep_hours = full_sweep_hours
+        self.rates: T.Dict[int, float] = {}
+        self.last_polled: T.Dict[int, float] = {}
+        self.last_seen: T.Dict[int, str] = {}
+        self.last_full_sweep = 0.0
+        self.df: T.Optional[pd.DataFrame] = None
+
+    def observe(self, df: pd.DataFrame, now: float = None):
+        """Update change rates from freshly polled locations, indexed by Id."""
+        now = now or time.time()
+        for location_id, date in zip(df.index, df["NextAvailableDate"].astype(str)):
+            prev_polled = self.last_polled.get(location_id)
+            if prev_polled is not None:
+                # floor at a minute so back to back polls don't blow up the rate
+                hours = max((now - prev_polled) / 3600, 1 / 60)
+                changed = date != self.last_seen[location_id]
+                self.rates[location_id] = self.alpha * changed / hours + (
+                    1 - self.alpha
+                ) * self.rates.get(location_id, self.prior_rate)
+            self.last_polled[location_id] = now
+            self.last_seen[location_id] = date
+
+    def urgency(self, location_id: int, now: float, hot: T.Set[int] = ()) -> float:
+        """Get the expected number of changes missed since the location was polled."""
+        if location_id not in self.last_polled:
+            return math.inf
+        hours = (now - self.last_polled[location_id]) / 3600
+        weight = self.hot_weight if location_id in hot else 1.0
+        return weight * self.rates.get(location_id, self.prior_rate) * hours
+
+    def choose(
+        self,
+        city_locations: T.Dict[str, T.Iterable[int]],
+        budget: int,
+        hot: T.Set[int] = (),
+        now: float = None,
+    ) -> T.List[str]:
+        """Pick up to `budget` cities covering the most urgent locations.
+
+        Like `greedy_set_cover`, but each city is worth the total urgency of the
+        locations it'd refresh that aren't already being refreshed.
+        """
+        now = now or time.time()
+        remaining = {c: set(ids) for c, ids in city_locations.items()}
+        scores = {
+            i: self.urgency(i, now, hot) for ids in remaining.values() for i in ids
+        }
+        chosen = []
+
+        while remaining and len(chosen) < budget:
+            gains = {c: sum(scores[i] for i in ids) for c, ids in remaining.items()}
+            # sort for a deterministic tie break
+            best = max(sorted(gains), key=gains.get)
+            if not gains[best]:
+                break
+            chosen.append(best)
+            for i in remaining.pop(best):
+                scores[i] = 0.0
+
+        return chosen
+
+    def budget(self, ticks: int) -> int:
+        """Split the lookups of one covering sweep evenly over `ticks` runs."""
+        return math.ceil(len(greedy_set_cover(PLANNER.city_locations)) / ticks)
+
+    async def refresh(self, ticks: int, hot: T.Set[int] = ()) -> pd.DataFrame:
+        """Refresh the snapshot, returning it indexed by Id.
+
+        :param ticks: runs per covering sweep's worth of lookups; e.g. running
+            5 times as often as a fixed interval pull with `ticks=5` keeps the
+            same request rate
+        :param hot: ids of locations to refresh more eagerly
+        """
+        now = time.time()
+        if (
+            self.df is None
+            or not PLANNER.city_locations
+            or (now - self.last_full_sweep) / 3600 >= self.full_sweep_hours
+        ):
+            logging.info("Rebuilding location snapshot from a full sweep.")
+            # every city rather than a planned cover, so that locations the
+            # planner hasn't learned about yet are found
+            self.df = await fetch_cities(await get_site_info())
+            self.last_full_sweep = now
+            self.observe(self.df, now)
+            return self.df
+
+        cities = self.choose(PLANNER.city_locations, self.budget(ticks), hot, now)
+        logging.info(f"Refreshing {len(cities)} cities with the most urgent locations.")
+        if not cities:
+            return self.df
+
+        fresh = await fetch_cities(cities)
+        self.observe(fresh, now)
+        self.df = merge_snapshot(self.df, fresh)
+        return self.df
@@ -0,0 +1,266 @@
+"""Scan DPS locations for appointment slots matching some criteria."""
+import asyncio
+import logging
+import os
+import typing as T
+from datetime import datetime
+
+import pandas as pd
+
+from txdps.api import (
+    POOL,
+    SCHEDULER,
+    LocationCollector,
+    get_all_cities_info,
+    get_appointment_info,
+    get_city_info,
+    get_site_info,
+    parse_locations,
+)
+from txdps.coverage import CoveragePlanner
+from txdps.distance import is_valid_zip
+from txdps.fetch import FetchResult
+from txdps.slots import SlotTable
+
+PLANNER = CoveragePlanner(
+    path=os.getenv("TXDPS_COVERAGE_FILE"),
+    full_sweep_hours=float(os.getenv("TXDPS_FULL_SWEEP_HOURS", 24)),
+)
+
+
+def successful(results: T.List[FetchResult], what: str) -> list:
+    """Unwrap successful fetch results, logging (or raising, if none) failures."""
+    failed = [r for r in results if not r.ok]
+    if failed:
+        logging.warning(
+            f"Failed to fetch {len(failed)} of {len(results)} {what}: "
+            f"{[r.key for r in failed]}"
+        )
+        if len(failed) == len(results):
+            raise failed[0].error
+    return [r.value for r in results if r.ok]
+
+
+async def plan_cities(
+    cities: T.List[str] = None, zip_code: int = None, max_dist: float = None
+) -> T.List[str]:
+    """Get the cities to look up in order to find every location of interest.
+
+    If `max_dist` is given, cities whose locations are known to all be further
+    than that from `zip_code` aren't looked up at all.
+    """
+    if not cities:
+        cities = await get_site_info()
+
+    origin = is_valid_zip(zip_code) if zip_code and max_dist else None
+    if origin is not None:
+        cities = PLANNER.prune(cities, origin, max_dist)
+
+    return PLANNER.plan(cities)
+
+
+def learn(city_results: T.List[FetchResult], df: pd.DataFrame):
+    """Teach the planner which locations each city lookup returned."""
+    PLANNER.learn(
+        {r.key: [rec["Id"] for rec in r.value] for r in city_results if r.ok},
+        location_coords=dict(zip(df["Id"], zip(df["Latitude"], df["Longitude"]))),
+    )
+
+
+async def fetch_locations(
+    cities: T.List[str] = None, zip_code: int = None, max_dist: float = None
+) -> pd.DataFrame:
+    """Pull DPS location info from the API and return in dataframe."""
+    cities = await plan_cities(cities=cities, zip_code=zip_code, max_dist=max_dist)
+    return await fetch_cities(cities, zip_code=zip_code)
+
+
+async def fetch_cities(cities: T.List[str], zip_code: int = None) -> pd.DataFrame:
+    """Look up exactly the given cities and return their locations in dataframe."""
+    # load most of the data we need here
+    results = await get_all_cities_info(cities=cities)
+    # since looking up all locations nearest to a specific city can return
+    # the same location for 2 different cities, deduplicate on DPS location id
+    collector = LocationCollector()
+    for records in successful(results, "cities"):
+        collector.add(records)
+    df = collector.to_frame(zip_code=zip_code)
+
+    learn(results, df)
+    return df.set_index("Id").sort_values("NextAvailableDate")
+
+
+async def _tagged(tag: str, coro: T.Awaitable) -> T.Tuple[str, T.Any]:
+    return tag, await coro
+
+
+async def stream_slots(
+    cities: T.List[str],
+    accept: T.Callable[[pd.DataFrame], pd.DataFrame],
+    zip_code: int = None,
+    all_slots: bool = False,
+) -> T.AsyncIterator[dict]:
+    """Yield the next available slot at each accepted location as soon as known.
+
+    Each location returned by a city lookup is passed through `accept` as soon
+    as that lookup lands; accepted locations have their slots looked up right
+    away, while other cities are still in flight.
+
+    :param cities: cities to look up, as planned by `plan_cities`
+    :param accept: filters a frame of newly found locations down to the ones
+        worth looking up slots for
+    :param zip_code: find distance from DPS location to this zip code in miles
+    :param all_slots: also look up every open slot at each location, under "Slots"
+    """
+    session = await POOL.get_session()
+    collector = LocationCollector()
+    city_results = []
+    locations = {}
+    done = asyncio.Queue()
+    pending = set()
+
+    def submit(tag: str, key: T.Any, fn: T.Callable, **kwargs):
+        task = asyncio.ensure_future(
+            _tagged(tag, SCHEDULER.fetch(key, fn, session, **kwargs))
+        )
+        pending.add(task)
+        task.add_done_callback(done.put_nowait)
+
+    for city in cities:
+        submit("city", city, get_city_info, city=city)
+
+    try:
+        while pending:
+            task = await done.get()
+            pending.discard(task)
+            tag, result = task.result()
+
+            if not result.ok:
+                logging.warning(f"Failed to fetch {tag} '{result.key}': {result.error}")
+                continue
+
+            if tag == "city":
+                city_results.append(result)
+                new = collector.add(result.value)
+                if not new:
+                    continue
+
+                df = accept(parse_locations(new, zip_code=zip_code))
+                for row in df.to_dict(orient="records"):
+                    locations[row["Id"]] = row
+                    submit(
+                        "location",
+                        row["Id"],
+                        get_appointment_info,
+                        site_name=row["Name"],
+                        site_id=row["Id"],
+                        all_slots=all_slots,
+                    )
+            else:
+                yield {**locations[result.key], **result.value}
+    finally:
+        for task in pending:
+            task.cancel()
+        if city_results:
+            learn(city_results, collector.to_frame())
+
+
+async def stream_matching_slots(
+    cities: T.List[str],
+    zip_code: int,
+    max_dist: float,
+    min_date: datetime.date,
+    max_date: datetime.date,
+    weekdays: T.List[int] = None,
+    hours: T.Tuple[int, int] = None,
+) -> T.AsyncIterator[dict]:
+    """Yield the next available slot at each matching location as soon as known.
+
+    If `weekdays` or `hours` are given, every slot at each location is looked
+    up, and the earliest one matching is yielded instead.
+    """
+    cities = await plan_cities(cities=cities, zip_code=zip_code, max_dist=max_dist)
+    all_slots = weekdays is not None or hours is not None
+
+    def accept(df: pd.DataFrame) -> pd.DataFrame:
+        mask = (df.NextAvailableDate < max_date) & (df["Distance"] <= max_dist)
+        # with all slots, a location's next slot may be too early but later
+        # ones may still match
+        if not all_slots:
+            mask &= df.NextAvailableDate > min_date
+        return df[mask]
+
+    slots = stream_slots(cities, accept, zip_code=zip_code, all_slots=all_slots)
+    try:
+        async for slot in slots:
+            if all_slots:
+                match = SlotTable.from_slots(
+                    (slot["Id"], s) for s in slot.pop("Slots")
+                ).earliest(min_date, max_date, weekdays=weekdays, hours=hours)
+                if match is None:
+                    continue
+                slot.update(
+                    ApptStartDateTime=match["StartDateTime"],
+                    ApptEndDateTime=match["EndDateTime"],
+                    ApptSlotId=match["SlotId"],
+                    ApptDuration=match["Duration"],
+                )
+            yield slot
+    finally:
+        await slots.aclose()
+
+
+async def fetch_slot_table(
+    cities: T.List[str] = None, zip_code: int = None, max_dist: float = None
+) -> T.Tuple[pd.DataFrame, SlotTable]:
+    """Pull every location and every open slot at each, for querying in memory.
+
+    :return: locations indexed by Id, and all their slots
+    """
+    cities = await plan_cities(cities=cities, zip_code=zip_code, max_dist=max_dist)
+
+    def accept(df: pd.DataFrame) -> pd.DataFrame:
+        if max_dist is None or "Distance" not in df:
+            return df
+        return df[df["Distance"] <= max_dist]
+
+    locations, slots = [], []
+    async for location in stream_slots(
+        cities, accept, zip_code=zip_code, all_slots=True
+    ):
+        slots.extend((location["Id"], s) for s in location.pop("Slots"))
+        locations.append(location)
+
+    df = pd.DataFrame(locations) if locations else pd.DataFrame(columns=["Id"])
+    return df.set_index("Id"), SlotTable.from_slots(slots)
+
+
+async def find_matching_slots(
+    cities: T.List[str],
+    zip_code: int,
+    max_dist: float,
+    min_date: datetime.date,
+    max_date: datetime.date,
+    weekdays: T.List[int] = None,
+    hours: T.Tuple[int, int] = None,
+    **kwargs,
+) -> T.Optional[pd.DataFrame]:
+    """Collect every matching slot into a dataframe indexed by location id."""
+    matches = [
+        match
+        async for match in stream_matching_slots(
+            cities=cities,
+            zip_code=zip_code,
+            max_dist=max_dist,
+            min_date=min_date,
+            max_date=max_date,
+            weekdays=weekdays,
+            hours=hours,
+        )
+    ]
+
+    if not matches:
+        logging.info("No appointments found.")
+        return
+
+    return pd.DataFrame(matches).set_index("Id")
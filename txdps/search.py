@@ -1,13 +1,26 @@
-"""Functions for using Algolia for search."""
+"""Functions for searching locations, with Algolia or a local index."""
+import bisect
 import logging
 import os
+import re
+import threading
+import time
+import typing as T
+from collections import OrderedDict, defaultdict
 
 import pandas as pd
 from algoliasearch.search_client import SearchClient
 
+from txdps.snapshot import read_snapshot
+
 ALGOLIA_APP_ID = os.getenv("ALGOLIA_APP_ID")
 ALGOLIA_API_KEY = os.getenv("ALGOLIA_API_KEY")
 
+# "algolia" or "local"; defaults to Algolia only if it's configured
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND") or (
+    "algolia" if ALGOLIA_APP_ID and ALGOLIA_API_KEY else "local"
+)
+
 
 def get_index():
     """Authenticate with Algolia and get index object."""
@@ -18,9 +31,11 @@ def get_index():
 def create_index(uri: str):
     """Create and configure an Algolia index and fill it with objects.
 
-    NB: Don't run this over and over; it'll use up all your freemium operations
+    NB: Don't run this over and over; it'll use up all your freemium operations.
+    Web workers keep serving results cached from the old index until they
+    expire (see `QUERY_CACHE`).
     """
-    df = pd.read_csv(uri)
+    df = read_snapshot(uri)
     # this is the only thing that changes; in order to not drive up
     # the number of Algolia operations, which costs $$$,
     # just index on relatively static fields
@@ -39,14 +54,251 @@ def create_index(uri: str):
     )
 
 
-def filter_df(df: pd.DataFrame, query: str):
-    """Filter a dataframe based on a dash data table filter query."""
+def _terms(text: str) -> T.List[str]:
+    return re.findall(r"[a-z0-9]+", str(text).lower())
+
+
+def _trigrams(term: str) -> T.Set[str]:
+    padded = f"  {term} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}  # noqa: E203
+
+
+def _typos_allowed(term: str) -> int:
+    # same as Algolia's defaults
+    return 0 if len(term) < 4 else 1 if len(term) < 8 else 2
+
+
+def _edit_distance(a: str, b: str, limit: int) -> int:
+    """Count typos between strings, or limit + 1 if more than `limit`.
+
+    Typos are insertions, deletions, substitutions and swaps of adjacent
+    characters (i.e. optimal string alignment distance).
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before, prev = None, list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        curr = [i]
+        for j, cb in enumerate(b, 1):
+            d = min(prev[j] + 1, curr[j - 1] + 1, prev[j - 1] + (ca != cb))
+            if i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                d = min(d, before[j - 2] + 1)
+            curr.append(d)
+        if min(curr) > limit:
+            return limit + 1
+        before, prev = prev, curr
+    return prev[-1]
+
+
+class LocalIndex:
+    """In memory search over locations, tolerant of prefixes and typos.
+
+    Every word of the query has to match a word of some searchable field of a
+    location, either exactly, as a prefix (as when still typing it), or with a
+    few typos. Locations are ranked by how closely their words matched.
+
+    Usage:
+    >>> index = LocalIndex(pd.DataFrame({
+    ...     "SiteId": [1, 2, 3],
+    ...     "SiteName": ["Austin North", "Houston Mega Center", "Dallas East"],
+    ...     "ZipCode": ["78753", "77040", "75228"],
+    ... }))
+    >>> index.search("houst"), index.search("mega hosuton"), index.search("7")
+    ([2], [2], [1, 2, 3])
+    """
+
+    FIELDS = ["SiteName", "CityName", "Address", "ZipCode"]
+    EXACT, PREFIX, TYPO = 3, 2, 1
+
+    def __init__(self, df: pd.DataFrame):
+        """Index the searchable fields of locations, which must have a SiteId."""
+        self.site_ids = df["SiteId"].tolist()
+        postings = defaultdict(set)
+        fields = [df[f].tolist() for f in self.FIELDS if f in df]
+        for doc, texts in enumerate(zip(*fields)):
+            for text in texts:
+                for term in _terms(text):
+                    postings[term].add(doc)
+        self._postings = {term: frozenset(docs) for term, docs in postings.items()}
+        self._sorted_terms = sorted(postings)
+        self._terms_by_trigram = defaultdict(set)
+        for term in postings:
+            for trigram in _trigrams(term):
+                self._terms_by_trigram[trigram].add(term)
+
+    def _match(self, word: str) -> T.Dict[int, int]:
+        """Score each location with a term matching the query word."""
+        scores = {}
+
+        def hit(term: str, score: int):
+            for doc in self._postings[term]:
+                scores[doc] = max(scores.get(doc, 0), score)
+
+        i = bisect.bisect_left(self._sorted_terms, word)
+        while i < len(self._sorted_terms) and self._sorted_terms[i].startswith(word):
+            term = self._sorted_terms[i]
+            hit(term, self.EXACT if term == word else self.PREFIX)
+            i += 1
+
+        typos = _typos_allowed(word)
+        if typos:
+            # a term within a few typos shares at least one trigram
+            candidates = set().union(
+                *(self._terms_by_trigram.get(t, ()) for t in _trigrams(word))
+            )
+            for term in candidates:
+                if (
+                    _edit_distance(word, term, typos) <= typos
+                    or _edit_distance(word, term[: len(word)], typos) <= typos
+                ):
+                    hit(term, self.TYPO)
+        return scores
+
+    def search(self, query: str) -> T.List[int]:
+        """Get the SiteIds of locations matching every word, best matches first."""
+        totals = None
+        for word in _terms(query):
+            scores = self._match(word)
+            if totals is None:
+                totals = scores
+            else:
+                totals = {d: totals[d] + s for d, s in scores.items() if d in totals}
+        if totals is None:
+            return list(self.site_ids)
+        ranked = sorted(totals, key=lambda doc: (-totals[doc], doc))
+        return [self.site_ids[doc] for doc in ranked]
+
+
+# (version of the locations indexed, index) of the last local index built
+_LOCAL_INDEX: T.Tuple[T.Optional[str], T.Optional[LocalIndex]] = (None, None)
+
+
+def _hash_version(df: pd.DataFrame) -> str:
+    fields = [f for f in ["SiteId", *LocalIndex.FIELDS] if f in df]
+    return str(pd.util.hash_pandas_object(df[fields], index=False).sum())
+
+
+def get_local_index(df: pd.DataFrame, version: str = None) -> LocalIndex:
+    """Get a local index over the locations, rebuilt only when they change.
+
+    :param version: identifies the snapshot the locations are from, e.g. its
+        hash; if not given, the locations' searchable fields are hashed
+    """
+    global _LOCAL_INDEX
+    version = version or _hash_version(df)
+    if version != _LOCAL_INDEX[0]:
+        _LOCAL_INDEX = (version, LocalIndex(df))
+        logging.info(f"Built local search index of {len(df)} locations")
+    return _LOCAL_INDEX[1]
+
+
+class _Flight:
+    """A lookup in progress, which other threads wanting it wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class QueryCache:
+    """Thread safe LRU cache of search results that expire after a TTL.
+
+    Concurrent lookups of the same key are only computed once ("single
+    flight"): the first caller computes the value while the rest wait for it.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 300):
+        """Create an empty cache.
+
+        :param max_size: results to keep before evicting least recently used
+        :param ttl: seconds to keep each result for
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: T.OrderedDict[T.Hashable, T.Tuple[float, T.Any]] = (
+            OrderedDict()
+        )
+        self._flights: T.Dict[T.Hashable, _Flight] = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: T.Hashable, compute: T.Callable[[], T.Any]) -> T.Any:
+        """Get the cached value for `key`, computing it if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                return entry[1]
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                generation = self._generation
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        computed = False
+        try:
+            flight.value = compute()
+            computed = True
+        except BaseException as exc:
+            flight.error = exc
+            raise
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                # don't cache results computed from before a `clear`
+                if computed and generation == self._generation:
+                    self._entries[key] = (time.monotonic() + self.ttl, flight.value)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_size:
+                        self._entries.popitem(last=False)
+            flight.done.set()
+        return flight.value
+
+    def clear(self):
+        """Forget every cached result, e.g. once the index changes."""
+        with self._lock:
+            self._entries.clear()
+            self._flights.clear()
+            self._generation += 1
+
+
+QUERY_CACHE = QueryCache(
+    max_size=int(os.getenv("TXDPS_SEARCH_CACHE_SIZE", 1024)),
+    ttl=float(os.getenv("TXDPS_SEARCH_CACHE_TTL", 300)),
+)
+
+
+def _search(df: pd.DataFrame, query: str, version: str = None) -> T.FrozenSet[int]:
+    if SEARCH_BACKEND == "local":
+        return frozenset(get_local_index(df, version=version).search(query))
+    index = get_index()
+    results = index.search(query, {"attributesToRetrieve": ["SiteId"]})
+    return frozenset(s["SiteId"] for s in results["hits"])
+
+
+def filter_df(df: pd.DataFrame, query: str, version: str = None):
+    """Filter a dataframe based on a dash data table filter query.
+
+    Results are cached per query and snapshot.
+
+    :param version: identifies the snapshot `df` is from, so that cached
+        results (and the local search index) are only reused for it
+    """
     logging.info(f"Filter query is: {query}")
 
     if query is None or not len(query.strip()):
         return df
 
-    index = get_index()
-    results = index.search(query, {"attributesToRetrieve": ["SiteId"]})
-    site_ids = [s["SiteId"] for s in results["hits"]]
+    if SEARCH_BACKEND == "local":
+        version = version or _hash_version(df)
+    key = (SEARCH_BACKEND, version, " ".join(query.lower().split()))
+    site_ids = QUERY_CACHE.get(key, lambda: _search(df, query, version=version))
     return df[df.SiteId.isin(site_ids)]
@@ -0,0 +1,142 @@
+"""Keep every open slot at every location in memory, in a compact columnar table.
+
+Slots are stored as typed numpy arrays sorted by start time, so date ranges are
+found by binary search and further criteria (locations, weekdays, hours) are
+vectorized masks over just that range, with no more API round trips.
+"""
+import typing as T
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# numpy day 0 (1970-01-01) was a Thursday
+_EPOCH_WEEKDAY = 3
+
+
+class SlotTable:
+    """Every open slot, as columns sorted by start time.
+
+    Usage:
+    >>> table = SlotTable.from_slots([
+    ...     (1, {"SlotId": 11, "StartDateTime": "2020-07-03T13:00:00",
+    ...          "EndDateTime": "2020-07-03T13:20:00", "Duration": 20}),
+    ...     (2, {"SlotId": 21, "StartDateTime": "2020-07-02T09:00:00",
+    ...          "EndDateTime": "2020-07-02T09:20:00", "Duration": 20}),
+    ... ])
+    >>> len(table)
+    2
+    >>> table.earliest(datetime(2020, 7, 1), datetime(2020, 8, 1))["SlotId"]
+    21
+    >>> table.earliest(datetime(2020, 7, 1), datetime(2020, 8, 1), hours=(12, 17))[
+    ...     "SlotId"
+    ... ]
+    11
+    >>> table.earliest(datetime(2020, 7, 1), datetime(2020, 8, 1), weekdays=[0])
+    """
+
+    def __init__(
+        self,
+        location_id: np.ndarray,
+        start: np.ndarray,
+        end: np.ndarray,
+        slot_id: np.ndarray,
+        duration: np.ndarray,
+    ):
+        """Wrap columns, which must already be sorted by start."""
+        self.location_id = location_id
+        self.start = start
+        self.end = end
+        self.slot_id = slot_id
+        self.duration = duration
+
+    @classmethod
+    def from_slots(cls, slots: T.Iterable[T.Tuple[int, dict]]) -> "SlotTable":
+        """Build from (location id, AvailableTimeSlots entry) pairs."""
+        slots = list(slots)
+        start = np.array([s["StartDateTime"] for _, s in slots], dtype="datetime64[m]")
+        order = np.argsort(start, kind="stable")
+        return cls(
+            location_id=np.array([i for i, _ in slots], dtype=np.int64)[order],
+            start=start[order],
+            end=np.array([s["EndDateTime"] for _, s in slots], dtype="datetime64[m]")[
+                order
+            ],
+            slot_id=np.array([s["SlotId"] for _, s in slots], dtype=np.int64)[order],
+            duration=np.array([s["Duration"] for _, s in slots], dtype=np.int16)[
+                order
+            ],
+        )
+
+    def __len__(self) -> int:
+        """Count slots."""
+        return len(self.start)
+
+    def query(
+        self,
+        min_date: datetime,
+        max_date: datetime,
+        location_ids: T.Iterable[int] = None,
+        weekdays: T.Iterable[int] = None,
+        hours: T.Tuple[int, int] = None,
+    ) -> np.ndarray:
+        """Get positions, in start order, of slots matching every criterion given.
+
+        :param min_date: slots starting after this
+        :param max_date: slots starting before this
+        :param location_ids: slots at these locations
+        :param weekdays: slots on these days of the week, with Monday as 0
+        :param hours: slots starting in this [from, to) range of hours of the day
+        """
+        lo = np.searchsorted(self.start, np.datetime64(min_date, "m"), side="right")
+        hi = np.searchsorted(self.start, np.datetime64(max_date, "m"), side="left")
+        start = self.start[lo:hi]
+        mask = np.ones(len(start), dtype=bool)
+
+        if location_ids is not None:
+            mask &= np.isin(self.location_id[lo:hi], list(location_ids))
+
+        days = start.astype("datetime64[D]")
+        if weekdays is not None:
+            weekday = (days.astype(np.int64) + _EPOCH_WEEKDAY) % 7
+            mask &= np.isin(weekday, list(weekdays))
+
+        if hours is not None:
+            hour = (start - days).astype("timedelta64[h]").astype(np.int64)
+            mask &= (hour >= hours[0]) & (hour < hours[1])
+
+        return lo + np.flatnonzero(mask)
+
+    def row(self, pos: int) -> dict:
+        """Get the slot at a position as an appointment dict."""
+        return {
+            "Id": int(self.location_id[pos]),
+            "SlotId": int(self.slot_id[pos]),
+            "StartDateTime": str(self.start[pos].astype("datetime64[s]")),
+            "EndDateTime": str(self.end[pos].astype("datetime64[s]")),
+            "Duration": int(self.duration[pos]),
+        }
+
+    def earliest(self, *args, **kwargs) -> T.Optional[dict]:
+        """Get the earliest slot matching the criteria of `query`, if any."""
+        found = self.query(*args, **kwargs)
+        return self.row(found[0]) if len(found) else None
+
+    def earliest_per_location(self, *args, **kwargs) -> T.List[dict]:
+        """Get the earliest slot matching the criteria of `query` at each location."""
+        found = self.query(*args, **kwargs)
+        # positions are in start order, so each location's first is its earliest
+        _, first = np.unique(self.location_id[found], return_index=True)
+        return [self.row(pos) for pos in found[np.sort(first)]]
+
+    def to_frame(self) -> pd.DataFrame:
+        """Get every slot as a dataframe."""
+        return pd.DataFrame(
+            {
+                "Id": self.location_id,
+                "SlotId": self.slot_id,
+                "StartDateTime": self.start,
+                "EndDateTime": self.end,
+                "Duration": self.duration,
+            }
+        )
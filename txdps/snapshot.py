@@ -0,0 +1,259 @@
+"""Read and write location snapshots, picking the format from the file extension.
+
+Snapshots are CSV unless their URI ends in .parquet (Parquet) or
+.arrow/.feather (Arrow IPC), formats which keep column types (so dates don't
+have to be parsed again on every read) and are compressed. Typed snapshots
+carry a schema version in their metadata, and reading one written with a
+different schema version fails rather than returning columns the callers
+don't expect.
+
+Snapshots are published along with a small manifest (`<uri>.manifest.json`)
+holding a hash of their contents and when they were last updated, so that
+unchanged snapshots aren't uploaded again and readers can cheaply check
+whether they need to reload. A change feed (`<uri>.changes.json`) listing
+what changed since the previous snapshot is published with each one.
+"""
+import hashlib
+import json
+import logging
+import os
+import typing as T
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+
+import fsspec
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from txdps.changes import diff_snapshots
+
+SCHEMA_VERSION = 1
+SCHEMA_VERSION_KEY = b"txdps.schema_version"
+COMPRESSION = os.getenv("TXDPS_SNAPSHOT_COMPRESSION", "zstd")
+DATE_COLUMNS = ["NextAvailableDate"]
+
+FORMATS = {
+    ".csv": "csv",
+    ".parquet": "parquet",
+    ".pq": "parquet",
+    ".arrow": "arrow",
+    ".feather": "arrow",
+}
+
+
+def snapshot_format(uri: str) -> str:
+    """Get the snapshot format for a local path or S3 URI from its extension.
+
+    Without a recognized extension, snapshots are CSV.
+
+    Usage:
+    >>> snapshot_format("s3://bucket/locations.parquet")
+    'parquet'
+    >>> snapshot_format("locations.csv")
+    'csv'
+    >>> snapshot_format("s3://bucket/path")
+    'csv'
+    """
+    ext = os.path.splitext(urlparse(uri).path)[1].lower()
+    return FORMATS.get(ext, "csv")
+
+
+def _to_table(df: pd.DataFrame) -> pa.Table:
+    table = pa.Table.from_pandas(df)
+    metadata = {**(table.schema.metadata or {})}
+    metadata[SCHEMA_VERSION_KEY] = str(SCHEMA_VERSION).encode()
+    return table.replace_schema_metadata(metadata)
+
+
+def _from_table(table: pa.Table, uri: str) -> pd.DataFrame:
+    version = (table.schema.metadata or {}).get(SCHEMA_VERSION_KEY)
+    if version != str(SCHEMA_VERSION).encode():
+        raise ValueError(
+            f"Snapshot at {uri} has schema version {version}, "
+            f"expected {SCHEMA_VERSION}"
+        )
+    return table.to_pandas()
+
+
+def _is_local(uri: str) -> bool:
+    return urlparse(uri).scheme in ("", "file")
+
+
+def _write(df: pd.DataFrame, uri: str, fmt: str):
+    if fmt == "csv":
+        df.to_csv(uri)
+        return
+
+    table = _to_table(df)
+    with fsspec.open(uri, "wb") as f:
+        if fmt == "parquet":
+            pq.write_table(table, f, compression=COMPRESSION)
+        else:
+            options = pa.ipc.IpcWriteOptions(compression=COMPRESSION)
+            with pa.ipc.new_file(f, table.schema, options=options) as writer:
+                writer.write_table(table)
+
+
+def write_snapshot(df: pd.DataFrame, uri: str):
+    """Write a snapshot of locations to a local path or S3 URI.
+
+    Local files are written to a temp file that then replaces the old one, so
+    readers never see a partially written file; S3 objects are only visible
+    once fully uploaded anyway.
+    """
+    fmt = snapshot_format(uri)
+    if not _is_local(uri):
+        _write(df, uri, fmt)
+        return
+
+    path = urlparse(uri).path
+    tmp_path = f"{path}.tmp"
+    _write(df, tmp_path, fmt)
+    os.replace(tmp_path, path)
+
+
+def read_snapshot(uri: str) -> pd.DataFrame:
+    """Read a snapshot of locations, with Id as a column and dates parsed."""
+    fmt = snapshot_format(uri)
+    if fmt == "csv":
+        df = pd.read_csv(uri)
+        for col in DATE_COLUMNS:
+            if col in df:
+                df[col] = pd.to_datetime(df[col])
+        return df
+
+    with fsspec.open(uri, "rb") as f:
+        if fmt == "parquet":
+            table = pq.read_table(f)
+        else:
+            table = pa.ipc.open_file(f).read_all()
+
+    df = _from_table(table, uri)
+    return df.reset_index() if df.index.name == "Id" else df
+
+
+def snapshot_hash(df: pd.DataFrame) -> str:
+    """Hash a snapshot's contents, regardless of the format it's stored in."""
+    digest = hashlib.sha256()
+    digest.update(json.dumps([str(df.index.name), *map(str, df.columns)]).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    return digest.hexdigest()
+
+
+def manifest_uri(uri: str) -> str:
+    """Get where the manifest for the snapshot at `uri` is published."""
+    return f"{uri}.manifest.json"
+
+
+def read_manifest(uri: str) -> T.Optional[dict]:
+    """Read the manifest for the snapshot at `uri`, if one was published."""
+    try:
+        with fsspec.open(manifest_uri(uri), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def changes_uri(uri: str) -> str:
+    """Get where the change feed for the snapshot at `uri` is published."""
+    return f"{uri}.changes.json"
+
+
+def read_changes(uri: str) -> T.Optional[dict]:
+    """Read the latest change feed for the snapshot at `uri`, if published."""
+    try:
+        with fsspec.open(changes_uri(uri), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_json(uri: str, obj: dict):
+    if not _is_local(uri):
+        with fsspec.open(uri, "w") as f:
+            json.dump(obj, f)
+        return
+
+    path = urlparse(uri).path
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(obj, f)
+    os.replace(tmp_path, path)
+
+
+def _version_id(uri: str) -> T.Optional[str]:
+    """Get the version id S3 assigned to an object, if bucket versioning is on."""
+    if _is_local(uri):
+        return None
+    info = fsspec.open(uri).fs.info(uri)
+    version_id = info.get("VersionId")
+    return None if version_id in (None, "null") else version_id
+
+
+# uri -> (hash, frame) of the last snapshot published from this process, so
+# diffing against it doesn't need the snapshot to be read back
+_PUBLISHED: T.Dict[str, T.Tuple[str, pd.DataFrame]] = {}
+
+
+def _previous_snapshot(uri: str, digest: str) -> T.Optional[pd.DataFrame]:
+    published = _PUBLISHED.get(uri)
+    if published is not None and published[0] == digest:
+        return published[1]
+    try:
+        return read_snapshot(uri)
+    except (FileNotFoundError, ValueError):
+        logging.exception(f"Failed to read previous snapshot to diff: {uri}")
+        return None
+
+
+def publish_snapshot(df: pd.DataFrame, uri: str) -> bool:
+    """Write a snapshot, its change feed, and its manifest, unless unchanged.
+
+    The manifest is written last, so it never describes a snapshot (or change
+    feed) that isn't there yet. The change feed lists the changes since the
+    snapshot with `previous_hash`; consumers that didn't see that one should
+    reload the whole snapshot instead. On versioned S3 buckets the manifest
+    also records the object version written, for readers that want that
+    exact snapshot.
+
+    :return: whether anything was written
+    """
+    digest = snapshot_hash(df)
+    manifest = read_manifest(uri)
+    previous_hash = manifest and manifest.get("hash")
+    if previous_hash == digest:
+        logging.info(f"Snapshot unchanged, not rewriting: {uri}")
+        return False
+
+    # read before it's overwritten
+    prev = _previous_snapshot(uri, previous_hash) if previous_hash else None
+    updated_at = datetime.now(timezone.utc).isoformat()
+
+    write_snapshot(df, uri)
+    if prev is not None:
+        changes = diff_snapshots(prev, df)
+        _write_json(
+            changes_uri(uri),
+            {
+                "hash": digest,
+                "previous_hash": previous_hash,
+                "updated_at": updated_at,
+                "changes": changes,
+            },
+        )
+        logging.info(f"Published {len(changes)} changes: {changes_uri(uri)}")
+
+    _write_json(
+        manifest_uri(uri),
+        {
+            "hash": digest,
+            "previous_hash": previous_hash,
+            "updated_at": updated_at,
+            "rows": len(df),
+            "schema_version": SCHEMA_VERSION,
+            "version_id": _version_id(uri),
+        },
+    )
+    _PUBLISHED[uri] = (digest, df)
+    return True
@@ -0,0 +1,142 @@
+"""Grid index over DPS locations for radius and nearest-neighbour queries.
+
+Locations are bucketed into cells of `cell_deg` degrees of lat/long, so
+finding the locations within some distance of a point only measures the
+distance to those in the handful of cells overlapping that circle's bounding
+box, rather than to every location.
+"""
+import hashlib
+import math
+import typing as T
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+from txdps.distance import RADII, haversine_matrix
+
+# miles per degree of latitude (and of longitude at the equator)
+MILES_PER_DEG = RADII["mi"] * math.pi / 180
+
+
+class GridIndex:
+    """Bucket locations by lat/long cell to find those near a point quickly.
+
+    Usage:
+    >>> austin, houston, dallas = (30.27, -97.74), (29.76, -95.37), (32.78, -96.8)
+    >>> index = GridIndex([1, 2, 3], [austin, houston, dallas])
+    >>> index.within(austin, 150).round(1)
+    1      0.0
+    2    146.1
+    dtype: float64
+    >>> index.nearest((30.0, -95.5), 2).index.tolist()
+    [2, 1]
+    """
+
+    def __init__(
+        self,
+        ids: T.Iterable[int],
+        latlongs: T.Iterable[T.Tuple[float, float]],
+        cell_deg: float = 0.5,
+    ):
+        """Index the locations with the given ids and lat/longs.
+
+        :param cell_deg: width of each cell in degrees of lat and long
+        """
+        self.ids = np.asarray(list(ids))
+        self.latlongs = np.asarray(list(latlongs), dtype=float).reshape(-1, 2)
+        self.cell_deg = cell_deg
+
+        cells = defaultdict(list)
+        for i, cell in enumerate(map(tuple, self._cell(self.latlongs))):
+            cells[cell].append(i)
+        self._cells = {cell: np.array(rows) for cell, rows in cells.items()}
+
+    def __len__(self) -> int:
+        """Count the locations indexed."""
+        return len(self.ids)
+
+    def _cell(self, latlongs: np.ndarray) -> np.ndarray:
+        return np.floor(latlongs / self.cell_deg).astype(int)
+
+    def _candidates(
+        self, origin: T.Tuple[float, float], radius: float
+    ) -> np.ndarray:
+        """Get the rows in cells overlapping the bounding box of the circle."""
+        lat, long = origin
+        dlat = radius / MILES_PER_DEG
+        max_lat = min(abs(lat) + dlat, 90)
+        if max_lat >= 89.9:
+            # bounding box wraps around the pole; every longitude may be in range
+            dlong = 180
+        else:
+            miles_per_deg_long = MILES_PER_DEG * math.cos(math.radians(max_lat))
+            dlong = min(radius / miles_per_deg_long, 180)
+
+        (lat0, long0), (lat1, long1) = self._cell(
+            np.array([[lat - dlat, long - dlong], [lat + dlat, long + dlong]])
+        )
+        if (lat1 - lat0 + 1) * (long1 - long0 + 1) > len(self._cells):
+            # cheaper to go through the occupied cells than the box's cells
+            rows = [
+                r
+                for (i, j), r in self._cells.items()
+                if lat0 <= i <= lat1 and long0 <= j <= long1
+            ]
+        else:
+            rows = [
+                self._cells[(i, j)]
+                for i in range(lat0, lat1 + 1)
+                for j in range(long0, long1 + 1)
+                if (i, j) in self._cells
+            ]
+        return np.concatenate(rows) if rows else np.array([], dtype=int)
+
+    def _distances(
+        self, origin: T.Tuple[float, float], rows: np.ndarray
+    ) -> pd.Series:
+        distances = haversine_matrix([origin], self.latlongs[rows])[0]
+        order = np.argsort(distances, kind="stable")
+        return pd.Series(distances[order], index=self.ids[rows][order], dtype=float)
+
+    def within(self, origin: T.Tuple[float, float], radius: float) -> pd.Series:
+        """Get distances in miles to locations within `radius` miles, nearest first.
+
+        :return: distances indexed by location id
+        """
+        distances = self._distances(origin, self._candidates(origin, radius))
+        return distances[distances <= radius]
+
+    def nearest(self, origin: T.Tuple[float, float], k: int) -> pd.Series:
+        """Get distances in miles to the `k` nearest locations, nearest first.
+
+        :return: distances indexed by location id
+        """
+        radius = self.cell_deg * MILES_PER_DEG
+        while radius < math.pi * RADII["mi"]:
+            distances = self.within(origin, radius)
+            # everything nearer than the kth nearest so far is within radius too
+            if len(distances) >= k:
+                return distances.iloc[:k]
+            radius *= 2
+        return self._distances(origin, np.arange(len(self))).iloc[:k]
+
+
+# (key of the locations indexed, index) of the last index built
+_INDEX: T.Tuple[T.Optional[str], T.Optional[GridIndex]] = (None, None)
+
+
+def location_index(
+    ids: T.Iterable[int], latlongs: T.Iterable[T.Tuple[float, float]]
+) -> GridIndex:
+    """Get an index over the given locations, reusing the last one if unchanged.
+
+    Only rebuilt when the set of locations (or their lat/longs) changes.
+    """
+    global _INDEX
+    ids = np.asarray(list(ids), dtype="int64")
+    latlongs = np.asarray(list(latlongs), dtype=float).reshape(-1, 2)
+    key = hashlib.sha1(ids.tobytes() + latlongs.tobytes()).hexdigest()
+    if key != _INDEX[0]:
+        _INDEX = (key, GridIndex(ids, latlongs))
+    return _INDEX[1]
@@ -0,0 +1,118 @@
+"""Remember which slots each subscriber was already notified of.
+
+Kept in a SQLite DB with one row per subscriber and slot they were told
+about. A slot is only worth notifying on if the subscriber wasn't already
+told about that same slot. Rows expire after a TTL, after which the
+subscriber is reminded of slots that are still open.
+"""
+import contextlib
+import sqlite3
+import time
+import typing as T
+
+import pandas as pd
+
+# bumped whenever the table changes; older tables are dropped and recreated,
+# which just means subscribers may be notified of open slots once more
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS seen_slots (
+    subscriber TEXT NOT NULL,
+    location_id INTEGER NOT NULL,
+    slot_id INTEGER,
+    slot_start TEXT,
+    notified_at REAL NOT NULL
+)
+"""
+
+INDEX = """
+CREATE INDEX IF NOT EXISTS seen_slots_subscriber
+ON seen_slots (subscriber, location_id)
+"""
+
+
+def _slot_key(location_id, slot_id, start) -> T.Tuple[int, T.Optional[int], str]:
+    """Identify a slot, with missing slot ids and start times as None."""
+    return (
+        int(location_id),
+        None if pd.isna(slot_id) else int(slot_id),
+        None if pd.isna(start) else str(start),
+    )
+
+
+class SeenSlots:
+    """Persistent store of slots already notified on, per subscriber."""
+
+    def __init__(self, path: str, ttl_hours: float = 24):
+        """Open (or create) the store.
+
+        :param path: SQLite DB file
+        :param ttl_hours: how long to suppress repeat notifications for
+        """
+        self.path = path
+        self.ttl_hours = ttl_hours
+        with self._connect() as conn:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version != SCHEMA_VERSION:
+                conn.execute("DROP TABLE IF EXISTS seen_slots")
+                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            conn.execute(SCHEMA)
+            conn.execute(INDEX)
+
+    @contextlib.contextmanager
+    def _connect(self) -> T.Iterator[sqlite3.Connection]:
+        """Connect, committing on success, and always close the connection."""
+        with contextlib.closing(sqlite3.connect(self.path)) as conn:
+            with conn:
+                yield conn
+
+    def expire(self, now: float = None) -> int:
+        """Forget notifications older than the TTL, returning how many."""
+        now = now or time.time()
+        with self._connect() as conn:
+            cur = conn.execute(
+                "DELETE FROM seen_slots WHERE notified_at < ?",
+                (now - self.ttl_hours * 3600,),
+            )
+            return cur.rowcount
+
+    def unseen(self, subscriber: str, df: pd.DataFrame) -> pd.DataFrame:
+        """Filter slots (indexed by location Id) down to ones not notified on."""
+        if df is None or not len(df):
+            return df
+
+        self.expire()
+        with self._connect() as conn:
+            seen = set(
+                conn.execute(
+                    "SELECT location_id, slot_id, slot_start FROM seen_slots "
+                    "WHERE subscriber = ?",
+                    (subscriber,),
+                ).fetchall()
+            )
+
+        mask = [
+            _slot_key(*slot) not in seen
+            for slot in zip(df.index, df["ApptSlotId"], df["ApptStartDateTime"])
+        ]
+        return df[mask]
+
+    def mark(self, subscriber: str, df: pd.DataFrame, now: float = None):
+        """Record that the subscriber was notified of the slots."""
+        now = now or time.time()
+        keys = {
+            _slot_key(*slot)
+            for slot in zip(df.index, df["ApptSlotId"], df["ApptStartDateTime"])
+        }
+        with self._connect() as conn:
+            # `IS` rather than `=` so that missing ids and start times match
+            conn.executemany(
+                "DELETE FROM seen_slots WHERE subscriber = ? AND location_id = ? "
+                "AND slot_id IS ? AND slot_start IS ?",
+                [(subscriber, *key) for key in keys],
+            )
+            conn.executemany(
+                "INSERT INTO seen_slots VALUES (?, ?, ?, ?, ?)",
+                [(subscriber, *key, now) for key in keys],
+            )
@@ -0,0 +1,194 @@
+"""Match many subscribers' criteria against a single shared scan.
+
+Subscriptions are read from a JSON file (a list of objects) or a SQLite DB
+with a `subscriptions` table, either having the fields of `Subscription`.
+Dates are given as YYYY-MM-DD.
+"""
+import bisect
+import json
+import logging
+import os
+import sqlite3
+import typing as T
+from collections import defaultdict
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from txdps.api import get_site_info
+from txdps.distance import haversine_matrix, is_valid_zip
+from txdps.scan import PLANNER, stream_slots
+
+
+class Subscription(T.NamedTuple):
+    """One watcher's criteria and contact details."""
+
+    id: str
+    zip_code: int
+    max_dist: float
+    min_date: datetime
+    max_date: datetime
+    phone_number: int = None
+    email_address: str = None
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "Subscription":
+        """Create from a JSON object or DB row."""
+        min_date = d.get("min_date")
+        max_date = d.get("max_date")
+        return cls(
+            id=str(d["id"]),
+            zip_code=int(d["zip_code"]),
+            max_dist=float(d["max_dist"]),
+            min_date=(
+                datetime.strptime(min_date, "%Y-%m-%d")
+                if min_date
+                else datetime.combine(datetime.now(), datetime.min.time())
+            ),
+            max_date=(
+                datetime.strptime(max_date, "%Y-%m-%d") if max_date else datetime.max
+            ),
+            phone_number=int(d["phone_number"]) if d.get("phone_number") else None,
+            email_address=d.get("email_address") or None,
+        )
+
+
+def load_subscriptions(path: str) -> T.List[Subscription]:
+    """Load subscriptions from a .json file or a SQLite DB."""
+    if path.endswith(".json"):
+        with open(path) as f:
+            rows = json.load(f)
+    else:
+        with sqlite3.connect(path) as conn:
+            conn.row_factory = sqlite3.Row
+            rows = [dict(r) for r in conn.execute("SELECT * FROM subscriptions")]
+
+    return [Subscription.from_dict(r) for r in rows]
+
+
+class WatchIndex:
+    """Index subscriptions by DPS location and date window.
+
+    For each location, the subscribers within range of it are found once and
+    kept sorted by min date, so matching a slot only bisects that list and
+    checks max dates, instead of checking every subscription.
+    """
+
+    def __init__(self, subscriptions: T.List[Subscription]):
+        """Build an index over the given subscriptions."""
+        self.subscriptions = []
+        self.origins: T.Dict[str, T.Tuple[float, float]] = {}
+        for sub in subscriptions:
+            origin = is_valid_zip(sub.zip_code)
+            if origin is None:
+                logging.warning(f"Skipping subscription with bad zip code: {sub.id}")
+                continue
+            self.subscriptions.append(sub)
+            self.origins[sub.id] = origin
+
+        self._origin_array = np.array(
+            [self.origins[sub.id] for sub in self.subscriptions], dtype=float
+        ).reshape(-1, 2)
+        self._max_dists = np.array([sub.max_dist for sub in self.subscriptions])
+        self._by_location: T.Dict[
+            int, T.Tuple[T.List[datetime], T.List[Subscription]]
+        ] = {}
+
+    def origin_radii(self) -> T.Dict[T.Tuple[float, float], float]:
+        """Get the largest distance of interest around each subscriber origin."""
+        radii = defaultdict(float)
+        for sub in self.subscriptions:
+            origin = self.origins[sub.id]
+            radii[origin] = max(radii[origin], sub.max_dist)
+        return dict(radii)
+
+    def _index_locations(
+        self,
+        location_ids: T.Iterable[int],
+        latlongs: T.Iterable[T.Tuple[float, float]],
+    ):
+        """Find the subscribers in range of each new location, in one go."""
+        new = [
+            (i, latlong)
+            for i, latlong in zip(location_ids, latlongs)
+            if i not in self._by_location
+        ]
+        if not new:
+            return
+
+        # (locations, subscribers) matrix of whether each is in range
+        in_range = (
+            haversine_matrix([latlong for _, latlong in new], self._origin_array)
+            <= self._max_dists
+        )
+        for (location_id, _), row in zip(new, in_range):
+            nearby = sorted(
+                (self.subscriptions[j] for j in np.flatnonzero(row)),
+                key=lambda sub: sub.min_date,
+            )
+            self._by_location[location_id] = (
+                [sub.min_date for sub in nearby],
+                nearby,
+            )
+
+    def _for_location(self, location_id: int, latlong: T.Tuple[float, float]):
+        self._index_locations([location_id], [latlong])
+        return self._by_location[location_id]
+
+    def match(
+        self, location_id: int, latlong: T.Tuple[float, float], date: datetime
+    ) -> T.List[Subscription]:
+        """Get subscriptions that a slot at the location on the given date fits."""
+        min_dates, subs = self._for_location(location_id, latlong)
+        # subscriptions are sorted by min date; skip all starting on/after date
+        n = bisect.bisect_left(min_dates, date)
+        return [sub for sub in subs[:n] if date < sub.max_date]
+
+    def accept(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Filter locations down to those some subscription could match."""
+        self._index_locations(df["Id"], zip(df["Latitude"], df["Longitude"]))
+        mask = [
+            bool(self.match(i, (lat, long), date))
+            for i, lat, long, date in zip(
+                df["Id"], df["Latitude"], df["Longitude"], df["NextAvailableDate"]
+            )
+        ]
+        return df[mask]
+
+
+_INDEX_CACHE: T.Dict[str, T.Tuple[float, WatchIndex]] = {}
+
+
+def load_index(path: str) -> WatchIndex:
+    """Load subscriptions into an index, reusing it until the file changes."""
+    mtime = os.stat(path).st_mtime
+    cached = _INDEX_CACHE.get(path)
+    if cached is None or cached[0] != mtime:
+        index = WatchIndex(load_subscriptions(path))
+        logging.info(f"Loaded {len(index.subscriptions)} subscriptions from {path}")
+        _INDEX_CACHE[path] = (mtime, index)
+    return _INDEX_CACHE[path][1]
+
+
+async def scan_for_subscribers(
+    index: WatchIndex,
+) -> T.Dict[Subscription, T.List[dict]]:
+    """Run one scan shared by every subscription, returning matches per subscriber."""
+    cities = await get_site_info()
+    # keep cities near any subscriber, in their original order
+    keep = set()
+    for origin, radius in index.origin_radii().items():
+        keep.update(PLANNER.prune(cities, origin, radius))
+    cities = PLANNER.plan([c for c in cities if c in keep])
+
+    matches = defaultdict(list)
+    async for slot in stream_slots(cities, index.accept):
+        latlong = (slot["Latitude"], slot["Longitude"])
+        for sub in index.match(slot["Id"], latlong, slot["NextAvailableDate"]):
+            matches[sub].append(slot)
+
+    logging.info(
+        f"Found slots for {len(matches)} of {len(index.subscriptions)} subscribers."
+    )
+    return dict(matches)
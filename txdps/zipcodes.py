@@ -0,0 +1,133 @@
+"""Offline zip code -> (lat, long) centroid table.
+
+The table is a (3, n) float32 array of zip codes (sorted), lats and longs,
+saved as a .npy file (~12 bytes per zip code, ~500KB for the whole US) and
+memory mapped, so looking up a zip is a binary search with nothing to download or
+query. A table of every US zip code ships in the package; rebuild it with
+`txdps build_zip_table`.
+"""
+import logging
+import os
+import typing as T
+
+import numpy as np
+import pandas as pd
+
+N_ZIPS = 100000
+
+
+class ZipTable:
+    """Look up zip code centroids from a prebuilt table."""
+
+    def __init__(self, path: str):
+        """Memory map the table at `path`."""
+        self.path = path
+        self.table = np.load(path, mmap_mode="r")
+        if self.table.ndim != 2 or self.table.shape[0] != 3:
+            raise ValueError(f"Not a zip code table: {path}")
+        # each is contiguous, so searching the zips doesn't copy them
+        self.zips, self._lats, self._longs = self.table
+
+    def __len__(self) -> int:
+        """Count zip codes in the table."""
+        return len(self.zips)
+
+    def latlongs(self, zips: T.Sequence[int]) -> np.ndarray:
+        """Get an (n, 2) array of centroids of zip codes, NaN for unknown ones."""
+        # search as float32, or else the whole zips column is cast to compare
+        zips = np.asarray(zips, dtype=np.float32)
+        rows = np.minimum(np.searchsorted(self.zips, zips), max(len(self) - 1, 0))
+        found = self.zips[rows] == zips if len(self) else np.zeros(len(zips), bool)
+        latlongs = np.full((len(zips), 2), np.nan)
+        latlongs[found, 0] = self._lats[rows[found]]
+        latlongs[found, 1] = self._longs[rows[found]]
+        return latlongs
+
+    def get(self, zip_code: int) -> T.Optional[T.Tuple[float, float]]:
+        """Get a zip code's centroid, or None if it isn't a known zip code."""
+        try:
+            zip_code = int(zip_code)
+        except (TypeError, ValueError):
+            return None
+        if not 0 <= zip_code < N_ZIPS:
+            return None
+
+        row = self.zips.searchsorted(np.float32(zip_code))
+        if row == len(self.zips) or self.zips[row] != zip_code:
+            return None
+        lat, long = self._lats[row], self._longs[row]
+        # float32 keeps ~7 significant digits; don't show noise beyond those
+        return round(float(lat), 5), round(float(long), 5)
+
+
+def load_zip_table(path: str) -> T.Optional[ZipTable]:
+    """Load the table at `path` if it's been built, else None."""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        return ZipTable(path)
+    except (OSError, ValueError) as exc:
+        logging.warning(f"Not using zip code table {path}: {exc}")
+        return None
+
+
+def _read_source(source: str) -> pd.DataFrame:
+    """Read zip, lat, long columns from a CSV, tab-separated or JSON file.
+
+    Column names are matched loosely so that e.g. the Census ZCTA gazetteer
+    (GEOID, INTPTLAT, INTPTLONG) or the `zipcodes` package's zips.json.bz2
+    (zip_code, lat, long) work as is.
+    """
+    if ".json" in os.path.basename(source):
+        df = pd.read_json(source, dtype=str)
+    else:
+        df = pd.read_csv(source, sep=None, engine="python", dtype=str)
+    df.columns = [c.strip().lower() for c in df.columns]
+
+    def find(*names):
+        col = next((c for c in df.columns if c in names), None)
+        if col is None:
+            raise ValueError(f"No column named any of {names} in {source}")
+        return col
+
+    return pd.DataFrame(
+        {
+            "zip": pd.to_numeric(df[find("zip", "zipcode", "zip_code", "geoid")]),
+            "lat": pd.to_numeric(df[find("lat", "latitude", "intptlat")]),
+            "long": pd.to_numeric(
+                df[find("lng", "lon", "long", "longitude", "intptlong")]
+            ),
+        }
+    ).dropna()
+
+
+def _read_uszipcode() -> pd.DataFrame:
+    """Dump every zip code with a centroid from the uszipcode DB."""
+    from uszipcode import SearchEngine
+
+    search = SearchEngine(simple_zipcode=True)
+    zips = search.by_coordinates(39.8, -98.6, radius=5000, returns=0)
+    return pd.DataFrame(
+        [(int(z.zipcode), z.lat, z.lng) for z in zips if z.lat is not None],
+        columns=["zip", "lat", "long"],
+    )
+
+
+def build_zip_table(out: str, source: str = None) -> ZipTable:
+    """Build the zip code table from a CSV of centroids, or from uszipcode.
+
+    :param out: .npy file to write
+    :param source: CSV or TSV of zip codes and their lat/longs; if not given,
+        the uszipcode DB (downloading it if needed) is used
+    """
+    df = _read_source(source) if source else _read_uszipcode()
+    df = df[(df["zip"] >= 0) & (df["zip"] < N_ZIPS)]
+    df = df.drop_duplicates("zip").sort_values("zip")
+
+    table = df[["zip", "lat", "long"]].to_numpy(dtype=np.float32).T.copy()
+    tmp_path = f"{out}.tmp.npy"
+    np.save(tmp_path, table)
+    os.replace(tmp_path, out)
+
+    logging.info(f"Wrote {len(df)} zip codes to {out}")
+    return ZipTable(out)